@@ -0,0 +1,207 @@
+"""Streaming GIF / APNG export of solve animations.
+
+`AnimationWriter` takes frames one at a time, straight from the move/render loop, and
+writes them to disk as they arrive: only the previous frame is kept in memory. Each frame
+after the first is reduced to the bounding box that changed since the previous frame, which
+for a solve animation is two cells and one line of text. GIF frames are quantized against
+the palette of the first frame, so the palette is computed once per animation.
+
+Example:
+    with AnimationWriter("solve.gif", duration=700) as writer:
+        for frame in image_graph.iter_move_frames(chunk_instructions, chunk_block_map):
+            writer.add_frame(frame)
+"""
+import io
+import os
+import struct
+import typing
+import zlib
+
+from PIL import GifImagePlugin, Image, ImageChops
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+ANIMATION_FORMATS = ("gif", "apng")
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(
+        ">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF
+        )
+
+
+def _iter_png_chunks(png_bytes: bytes) -> typing.Iterator[typing.Tuple[bytes, bytes]]:
+    position = len(PNG_SIGNATURE)
+    while position < len(png_bytes):
+        length, = struct.unpack(">I", png_bytes[position:position + 4])
+        chunk_type = png_bytes[position + 4:position + 8]
+        yield chunk_type, png_bytes[position + 8:position + 8 + length]
+        position += length + 12
+
+
+class AnimationWriter:
+    """Write an animated GIF or APNG frame by frame.
+
+    The format is taken from the file extension (`.gif`, `.png` / `.apng`) unless given.
+    `duration` is the default frame duration in milliseconds and `loop` the number of
+    loops, 0 meaning forever. Frames of a different size than the first one are pasted
+    onto a black canvas of the first frame's size.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            animation_format: str = None,
+            duration: int = 500,
+            loop: int = 0,
+            compress_level: int = 6
+            ) -> None:
+        if animation_format is None:
+            extension = os.path.splitext(path)[1].lower()
+            animation_format = "gif" if extension == ".gif" else "apng"
+        if animation_format not in ANIMATION_FORMATS:
+            raise ValueError(f"Unsupported animation format: {animation_format}")
+        self.path = path
+        self.animation_format = animation_format
+        self.duration = duration
+        self.loop = loop
+        self.compress_level = compress_level
+        self.num_frames = 0
+        self.size = None
+        self._file = open(path, "wb")
+        self._previous = None
+        self._palette_image = None
+        self._sequence_number = 0
+        self._actl_position = None
+
+    def add_frame(self, frame: Image.Image, duration: int = None) -> None:
+        """Append one frame; the frame can be reused by the caller once this returns."""
+        duration = self.duration if duration is None else duration
+        frame = frame.convert("RGB") if frame.mode != "RGB" else frame
+        if self.size is None:
+            self.size = frame.size
+        elif frame.size != self.size:
+            canvas = Image.new("RGB", self.size)
+            canvas.paste(frame, (0, 0))
+            frame = canvas
+
+        if self._previous is None:
+            box = (0, 0) + self.size
+        else:
+            box = ImageChops.difference(self._previous, frame).getbbox()
+            if box is None:
+                # Nothing changed, a single pixel keeps the frame and its duration.
+                box = (0, 0, 1, 1)
+        region = frame.crop(box)
+
+        if self.animation_format == "gif":
+            self._write_gif_frame(region, box[:2], duration)
+        else:
+            self._write_apng_frame(region, box[:2], duration)
+        self._previous = frame.copy()
+        self.num_frames += 1
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        if self.num_frames > 0:
+            if self.animation_format == "gif":
+                self._file.write(b";")
+            else:
+                self._file.write(_png_chunk(b"IEND", b""))
+                # The number of frames is only known now, patch it into the acTL chunk.
+                self._file.seek(self._actl_position)
+                self._file.write(_png_chunk(b"acTL", struct.pack(">II", self.num_frames, self.loop)))
+        self._file.close()
+
+    def __enter__(self) -> "AnimationWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _write_gif_frame(self, region: Image.Image, offset: tuple, duration: int) -> None:
+        if self._palette_image is None:
+            self._palette_image = region.quantize(colors=256)
+            quantized = self._palette_image
+            header, _ = GifImagePlugin.getheader(quantized, info={"loop": self.loop})
+            for block in header:
+                self._file.write(block)
+        else:
+            quantized = region.quantize(palette=self._palette_image, dither=Image.Dither.NONE)
+        for block in GifImagePlugin.getdata(quantized, offset=offset, duration=duration):
+            self._file.write(block)
+
+    def _write_apng_frame(self, region: Image.Image, offset: tuple, duration: int) -> None:
+        buffer = io.BytesIO()
+        region.save(buffer, format="PNG", compress_level=self.compress_level)
+        chunks = list(_iter_png_chunks(buffer.getvalue()))
+
+        if self._actl_position is None:
+            self._file.write(PNG_SIGNATURE)
+            self._file.write(_png_chunk(b"IHDR", chunks[0][1]))
+            self._actl_position = self._file.tell()
+            self._file.write(_png_chunk(b"acTL", struct.pack(">II", 0, self.loop)))
+
+        self._file.write(_png_chunk(b"fcTL", struct.pack(
+            ">IIIIIHHBB",
+            self._next_sequence_number(),
+            region.width,
+            region.height,
+            offset[0],
+            offset[1],
+            duration,
+            1000,
+            0,  # dispose_op: none
+            0   # blend_op: source
+            )))
+        for chunk_type, data in chunks:
+            if chunk_type != b"IDAT":
+                continue
+            if self.num_frames == 0:
+                self._file.write(_png_chunk(b"IDAT", data))
+            else:
+                self._file.write(_png_chunk(
+                    b"fdAT",
+                    struct.pack(">I", self._next_sequence_number()) + data
+                    ))
+
+    def _next_sequence_number(self) -> int:
+        sequence_number = self._sequence_number
+        self._sequence_number += 1
+        return sequence_number
+
+
+def write_animation(frames: typing.Iterable[Image.Image], path: str, **kwargs) -> int:
+    """Stream `frames` into an animation at `path`; returns the number of frames written."""
+    with AnimationWriter(path, **kwargs) as writer:
+        for frame in frames:
+            writer.add_frame(frame)
+    return writer.num_frames
+
+
+def render_solve_animation(
+        image_graph,
+        chunk_instructions: dict,
+        chunk_block_map: dict,
+        path: str,
+        start_image: Image.Image = None,
+        **kwargs
+        ) -> int:
+    """Animate the solution of the puzzle currently on `image_graph`.
+
+    This is the in-memory counterpart of `generate_images_for_demo` followed by
+    `create_animated_gif`: `start_image` (the labelled puzzle) is shown first, then every
+    move with its instruction panel. Returns the number of frames written.
+    """
+    frames = image_graph.iter_move_frames(chunk_instructions, chunk_block_map, copy_frames=False)
+    with AnimationWriter(path, **kwargs) as writer:
+        first_frame = next(frames)
+        if start_image is not None:
+            # Show the labelled puzzle in place of the board, next to the empty panel.
+            start_frame = first_frame.copy()
+            start_frame.paste(start_image, (start_frame.width - start_image.width, 0))
+            writer.add_frame(start_frame)
+        writer.add_frame(first_frame)
+        for frame in frames:
+            writer.add_frame(frame)
+    return writer.num_frames
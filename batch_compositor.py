@@ -0,0 +1,161 @@
+"""Vectorised composition of many puzzle images cut from the same source image.
+
+`ImageGraph._compose_updated_image` builds one puzzle with `Image.new`, a `paste` per tile
+and a `draw.text` per label. `BatchCompositor` builds a whole batch of boards at once: the
+tiles are held as one uint8 array, every tile is written to all boards of the batch with a
+single NumPy slice assignment into a preallocated `(batch, height, width, 3)` buffer, and
+block labels are stamped from glyph bitmaps rasterised once per label.
+
+The result is pixel-identical to `_compose_updated_image`: tiles are written in chunk
+order, each followed by its label, and labels are blended the way Pillow blends text.
+Between calls only the cells and labels drawn before are cleared, not the whole buffer.
+
+The boards are meant for consumers that want pixels as arrays, such as a training loop
+over a tensor export (`tensor_export.py`). Pillow keeps RGB pixels in four bytes, so turning
+the boards into `PIL.Image`s costs a conversion that outweighs the gain; the PNG writers of
+the driver therefore keep composing one puzzle at a time with Pillow.
+
+Example:
+    compositor = BatchCompositor(image_graph.tiles, image_graph.chunk_size, image_graph.graph_size)
+    boards = compositor.compose(positions, labels)
+"""
+import typing
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+import instrumentation
+from frame_renderer import load_font
+
+LABEL_BORDER = 38
+LABEL_OFFSET = 10
+LABEL_FONT_SIZE = 18
+LABEL_FILL = (255, 255, 255)
+
+
+class GlyphAtlas:
+    """Label masks rasterised once per text, with the offset at which they are drawn."""
+
+    def __init__(self, font: ImageFont.ImageFont) -> None:
+        self.font = font
+        self._glyphs = {}
+
+    def get(self, text: str) -> typing.Tuple[np.ndarray, int, int]:
+        """Return `(mask, dx, dy)`: the coverage of `text` drawn at (0, 0) starts at (dx, dy)."""
+        glyph = self._glyphs.get(text)
+        if glyph is None:
+            glyph = self._glyphs[text] = self._rasterize(text)
+        return glyph
+
+    def _rasterize(self, text: str) -> typing.Tuple[np.ndarray, int, int]:
+        left, top, right, bottom = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text, font=self.font)
+        # Pad so glyphs that extend left of or above the anchor are kept whole.
+        pad_x, pad_y = max(0, -left) + 1, max(0, -top) + 1
+        canvas = Image.new("L", (right + pad_x + 1, bottom + pad_y + 1))
+        ImageDraw.Draw(canvas).text((pad_x, pad_y), text, fill=255, font=self.font)
+        bbox = canvas.getbbox()
+        if bbox is None:
+            return np.zeros((0, 0), dtype=np.uint8), 0, 0
+        mask = np.asarray(canvas.crop(bbox), dtype=np.uint8)
+        return mask, bbox[0] - pad_x, bbox[1] - pad_y
+
+
+class BatchCompositor:
+    """Compose puzzle boards of one tile set into a reusable uint8 buffer.
+
+    `positions` are `(batch, tiles, 2)` arrays of the (x, y) cell of every tile and `labels`
+    hold one dict per board mapping tile indices to their block tag.
+    """
+
+    def __init__(
+            self,
+            tiles: typing.List[Image.Image],
+            chunk_size: typing.Tuple[int, int],
+            graph_size: int = 11,
+            font: ImageFont.ImageFont = None,
+            tile_array: np.ndarray = None
+            ) -> None:
+        """`tile_array` holds the RGB tiles when they are at hand already, e.g. mapped from a
+        `tile_store.TileStore`; `tiles` are converted otherwise."""
+        self.chunk_size = chunk_size
+        self.graph_size = graph_size
+        if tile_array is None:
+            tile_array = np.stack([np.asarray(tile.convert("RGB")) for tile in tiles])
+        self.tile_array = tile_array
+        self.width = graph_size * chunk_size[0]
+        self.height = graph_size * chunk_size[1] + LABEL_BORDER
+        self.glyphs = GlyphAtlas(font if font is not None else load_font(LABEL_FONT_SIZE))
+        self._buffer = np.zeros((0, self.height, self.width, 3), dtype=np.uint8)
+        # What the previous call drew, so only that is cleared instead of the whole buffer.
+        self._drawn_positions = None
+        self._drawn_labels = []
+
+    def _boards(self, batch_size: int) -> np.ndarray:
+        if self._buffer.shape[0] < batch_size:
+            self._buffer = np.zeros((batch_size, self.height, self.width, 3), dtype=np.uint8)
+        else:
+            if self._drawn_positions is not None:
+                cells = self._cells(self._buffer[:self._drawn_positions.shape[0]])
+                rows = np.arange(self._drawn_positions.shape[0])[:, None]
+                cells[rows, self._drawn_positions[..., 1], :, self._drawn_positions[..., 0]] = 0
+            for board_index, region in self._drawn_labels:
+                self._buffer[board_index][region] = 0
+        self._drawn_positions = None
+        self._drawn_labels = []
+        return self._buffer[:batch_size]
+
+    def _cells(self, boards: np.ndarray) -> np.ndarray:
+        """View boards as a grid of cells: cells[b, y, :, x] is the cell (x, y) of board b."""
+        chunk_width, chunk_height = self.chunk_size
+        return boards[:, :self.graph_size * chunk_height].reshape(
+            boards.shape[0], self.graph_size, chunk_height, self.graph_size, chunk_width, 3
+            )
+
+    def compose(self, positions: np.ndarray, labels: typing.List[dict] = None) -> np.ndarray:
+        """Return the `(batch, height, width, 3)` boards; a view valid until the next call."""
+        positions = np.asarray(positions)
+        batch_size = positions.shape[0]
+        chunk_width, chunk_height = self.chunk_size
+        with instrumentation.span("batch_composite"):
+            boards = self._boards(batch_size)
+            cells = self._cells(boards)
+            self._drawn_positions = positions.copy()
+            rows = np.arange(batch_size)
+            for tile_index, tile in enumerate(self.tile_array):
+                xs, ys = positions[:, tile_index, 0], positions[:, tile_index, 1]
+                cells[rows, ys, :, xs] = tile
+                if labels is None:
+                    continue
+                # Labels are drawn right after their tile, so later tiles cover them as before.
+                for board_index in range(batch_size):
+                    block_tag = labels[board_index].get(tile_index)
+                    if block_tag is not None:
+                        self._stamp(
+                            board_index,
+                            f"Block {block_tag}",
+                            int(xs[board_index]) * chunk_width,
+                            (int(ys[board_index]) + 1) * chunk_height + LABEL_OFFSET
+                            )
+        instrumentation.count("puzzles_composited", batch_size)
+        return boards
+
+    def compose_images(self, positions: np.ndarray, labels: typing.List[dict] = None) -> typing.List[Image.Image]:
+        return [Image.fromarray(board, "RGB") for board in self.compose(positions, labels)]
+
+    def _stamp(self, board_index: int, text: str, x: int, y: int) -> None:
+        board = self._buffer[board_index]
+        mask, dx, dy = self.glyphs.get(text)
+        left, top = x + dx, y + dy
+        right, bottom = left + mask.shape[1], top + mask.shape[0]
+        clip_left, clip_top = max(left, 0), max(top, 0)
+        clip_right, clip_bottom = min(right, board.shape[1]), min(bottom, board.shape[0])
+        if clip_left >= clip_right or clip_top >= clip_bottom:
+            return
+        alpha = mask[clip_top - top:clip_bottom - top, clip_left - left:clip_right - left, None].astype(np.uint32)
+        region_slices = (slice(clip_top, clip_bottom), slice(clip_left, clip_right))
+        self._drawn_labels.append((board_index, region_slices))
+        region = board[region_slices]
+        fill = np.array(LABEL_FILL, dtype=np.uint32)
+        # Pillow's BLEND: (a * (255 - m) + b * m) / 255, rounded as in its DIV255 macro.
+        blended = region.astype(np.uint32) * (255 - alpha) + fill * alpha + 128
+        region[...] = (((blended >> 8) + blended) >> 8).astype(np.uint8)
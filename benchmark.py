@@ -0,0 +1,466 @@
+"""Offline benchmarks of the generation hot paths.
+
+Synthetic source images of several resolutions are written to a temporary folder, then
+every stage of the pipeline is timed on its own and the whole per-image generation is
+timed end to end. Results are written as JSON so that runs on different commits can be
+compared with `--compare`.
+
+Example:
+    python benchmark.py --output bench_new.json --compare bench_old.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from create_graph_dataset import PathFinder
+from generate_dataset import GenerationConfig, generate_puzzles_for_image
+from graph_embedding import ImageGraph
+from image_encoders import get_encoder
+from multi_block_planner import PrioritizedPlanner
+from puzzle_sampler import PuzzleSampler
+
+DEFAULT_RESOLUTIONS = ("320x240", "640x480", "1280x960", "1920x1080")
+# Puzzles composed together by the batch_composite stage, the default samples per image.
+BATCH_SIZE = 5
+DEFAULT_ENCODERS = ("png", "png:compress_level=1", "png:optimize=1", "webp", "webp:method=0", "bmp")
+# Large tilings as TILESxTILES@GRID_SIZE:COMPLEXITY, run end to end with 32 pixel tiles.
+DEFAULT_LARGE_BOARDS = ("6x6@32:4", "8x8@32:8", "8x8@48:16")
+LARGE_BOARD_TILE_SIZE = 32
+# Puzzles per second and worker that large boards must reach, per output format.
+LARGE_BOARD_TARGETS = {"folder": 10.0, "tensors": 250.0}
+# Fresh interpreters timed by the cold_start section: CLI commands and a bare pool worker.
+COLD_START_COMMANDS = {
+    "python": ["-c", "pass"],
+    "cli": ["cli.py", "--help"],
+    "generate": ["cli.py", "generate", "--help"],
+    "render-demo": ["cli.py", "render-demo", "--help"],
+    "verify": ["cli.py", "verify", "--help"],
+    "publish": ["cli.py", "publish", "--help"],
+    "worker": ["-c", "import generate_dataset"]
+}
+
+
+def make_synthetic_image(path: str, width: int, height: int, seed: int = 0) -> None:
+    """Write a JPEG with smooth gradients plus noise, which compresses like a photo."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // max(width - 1, 1), y * 255 // max(height - 1, 1), (x + y) % 256], axis=-1)
+    noise = rng.integers(-24, 24, size=(height, width, 3))
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    Image.fromarray(pixels).save(path, quality=90)
+
+
+def time_stage(
+        function: typing.Callable[[typing.Any], typing.Any],
+        setup: typing.Callable[[], typing.Any] = None,
+        repeats: int = 5
+        ) -> dict:
+    """Time `function(setup())` `repeats` times; `setup` is not timed."""
+    durations = []
+    for _ in range(repeats):
+        argument = setup() if setup is not None else None
+        started = time.perf_counter()
+        function(argument)
+        durations.append((time.perf_counter() - started) * 1000)
+    return {
+        "repeats": repeats,
+        "mean_ms": statistics.fmean(durations),
+        "median_ms": statistics.median(durations),
+        "min_ms": min(durations),
+        "max_ms": max(durations)
+    }
+
+
+class PuzzleFixture:
+    """A fixed, reproducible puzzle on an `ImageGraph`, rebuilt for every repeat."""
+
+    def __init__(self, image_graph: ImageGraph, puzzle_complexity: int, seed: int = 0) -> None:
+        self.image_graph = image_graph
+        self.puzzle_complexity = puzzle_complexity
+        self.seed = seed
+
+    def __call__(self) -> tuple:
+        rng = random.Random(self.seed)
+        sampler = PuzzleSampler(
+            graph_size=self.image_graph.graph_size,
+            puzzle_complexity=self.puzzle_complexity,
+            rng=rng
+            )
+        planner = PrioritizedPlanner(rng=rng)
+        while True:
+            self.image_graph.reset()
+            graph = self.image_graph.graph
+            chunks = sampler.sample_chunks_for_shuffle(graph)
+            end_coords = sampler.sample_end_coords(graph, chunks)
+            try:
+                moves = self.image_graph.plan_moves(chunks, sampler.map_chunks_to_indices(chunks, end_coords), planner)
+            except ValueError:
+                continue
+            return moves, sampler.map_chunks_to_block_names(graph)
+
+
+def benchmark_stages(image_path: str, output_folder: str, repeats: int, puzzle_complexity: int) -> dict:
+    """Time every generation stage on one source image."""
+    results = {}
+    results["image_graph_init"] = time_stage(lambda _: ImageGraph(image_path), repeats=repeats)
+
+    image_graph = ImageGraph(image_path)
+    graph = image_graph.graph
+
+    def find_paths(_):
+        path_finder = PathFinder(graph)
+        path_finder.find_paths()
+        for chunk in graph.chunks:
+            for x in range(graph.width):
+                path_finder.paths[(chunk.x, chunk.y)][(x, 0)]
+    results["path_finder_find_paths"] = time_stage(find_paths, repeats=repeats)
+
+    sampler = PuzzleSampler(puzzle_complexity=2, rng=random.Random(0))
+    results["sampler_combinations"] = time_stage(
+        lambda _: sampler.create_combination_end_indices(sorted(sampler.get_non_chunk_indices(graph))),
+        repeats=repeats
+        )
+    chunks = sampler.sample_chunks_for_shuffle(graph)
+    results["sampler_end_coords"] = time_stage(
+        lambda _: sampler.sample_end_coords(graph, chunks, unique=False),
+        repeats=repeats
+        )
+
+    fixture = PuzzleFixture(image_graph, puzzle_complexity)
+    results["sample_and_plan"] = time_stage(
+        lambda _: fixture(),
+        repeats=repeats
+        )
+    results["generate_updated_image"] = time_stage(
+        lambda _: image_graph._generate_updated_image(),
+        repeats=repeats
+        )
+    boards = []
+    for _ in range(BATCH_SIZE):
+        moves, chunk_block_map = fixture()
+        image_graph.shuffle_chunks(moves, chunk_block_map)
+        boards.append(image_graph.graph.positions())
+    # A whole batch per repeat, to compare with BATCH_SIZE times generate_updated_image.
+    positions = np.stack(boards)
+    results["batch_composite"] = time_stage(
+        lambda _: image_graph.compose_batch(positions, [{0: "A", 8: "I"}] * BATCH_SIZE),
+        repeats=repeats
+        )
+    results["generate_data_point"] = time_stage(
+        lambda puzzle: image_graph.generate_data_point(puzzle[0], output_folder, "bench", puzzle[1], []),
+        setup=fixture,
+        repeats=repeats
+        )
+
+    def shuffled_puzzle():
+        moves, chunk_block_map = fixture()
+        data_point = image_graph.generate_data_point(moves, output_folder, "bench", chunk_block_map, [])
+        return data_point["moves"], chunk_block_map
+    frames_folder = os.path.join(output_folder, "frames")
+    os.makedirs(frames_folder, exist_ok=True)
+    results["move_chunks"] = time_stage(
+        lambda puzzle: image_graph.move_chunks(puzzle[0], frames_folder, puzzle[1]),
+        setup=shuffled_puzzle,
+        repeats=repeats
+        )
+    return results
+
+
+def benchmark_encoders(image_path: str, encoders: list, repeats: int, puzzle_complexity: int) -> dict:
+    """Time every encoder on a puzzle image and on a demo frame, and report their sizes."""
+    image_graph = ImageGraph(image_path)
+    moves, chunk_block_map = PuzzleFixture(image_graph, puzzle_complexity)()
+    data_point = image_graph.generate_data_point(moves, tempfile.gettempdir(), "bench", chunk_block_map, [],
+                                                 sample_writer=_NullSampleWriter())
+    images = {
+        "puzzle": data_point["start_image"],
+        "frame": next(iter(image_graph.iter_move_frames(data_point["moves"], chunk_block_map)))
+    }
+    results = {}
+    for spec in encoders:
+        encoder = get_encoder(spec)
+        results[encoder.spec] = {}
+        for kind, image in images.items():
+            result = time_stage(lambda _: encoder.encode(image), repeats=repeats)
+            result["bytes"] = len(encoder.encode(image))
+            result["pixels"] = image.width * image.height
+            results[encoder.spec][kind] = result
+    return results
+
+
+class _NullSampleWriter:
+    """Sample writer that drops everything, to render a puzzle without writing it."""
+
+    extension = "png"
+
+    def write_sample(self, *args, **kwargs) -> None:
+        pass
+
+
+def benchmark_end_to_end(
+        image_paths: list,
+        output_folder: str,
+        samples_per_image: int,
+        puzzle_complexity: int,
+        **config_options
+        ) -> dict:
+    """Run the per-image generation of the driver in this process."""
+    config = GenerationConfig(
+        output_folder=output_folder,
+        num_samples_per_image=samples_per_image,
+        puzzle_complexity=puzzle_complexity,
+        **config_options
+        )
+    started = time.perf_counter()
+    num_puzzles = 0
+    for image_path in image_paths:
+        count, _ = generate_puzzles_for_image(image_path, config, metadata=[])
+        num_puzzles += count
+    elapsed = time.perf_counter() - started
+    return {
+        "images": len(image_paths),
+        "puzzles": num_puzzles,
+        "seconds": elapsed,
+        "puzzles_per_second": num_puzzles / elapsed if elapsed else 0.0
+    }
+
+
+def parse_large_board(spec: str) -> typing.Tuple[int, int, int]:
+    """`"8x8@32:8"` -> (tiles_per_side, graph_size, puzzle_complexity)."""
+    tiling, _, rest = spec.partition("@")
+    graph_size, _, puzzle_complexity = rest.partition(":")
+    return int(tiling.split("x")[0]), int(graph_size), int(puzzle_complexity)
+
+
+def benchmark_large_boards(image_path: str, output_folder: str, boards: list, samples_per_image: int) -> dict:
+    """End-to-end throughput of large tilings, as images and as tensors, against the targets."""
+    results = {}
+    for spec in boards:
+        tiles_per_side, graph_size, puzzle_complexity = parse_large_board(spec)
+        results[spec] = {}
+        for output_format, target in LARGE_BOARD_TARGETS.items():
+            board_folder = os.path.join(output_folder, f"{spec}-{output_format}")
+            os.makedirs(board_folder, exist_ok=True)
+            result = benchmark_end_to_end(
+                [image_path],
+                board_folder,
+                samples_per_image,
+                puzzle_complexity,
+                graph_size=graph_size,
+                tiles_per_side=tiles_per_side,
+                puzzle_distance_thr=2 * tiles_per_side,
+                max_tile_size=LARGE_BOARD_TILE_SIZE,
+                output_format=output_format
+                )
+            result["target_puzzles_per_second"] = target
+            result["meets_target"] = result["puzzles_per_second"] >= target
+            results[spec][output_format] = result
+    return results
+
+
+def benchmark_cold_start(repeats: int) -> dict:
+    """Wall time of fresh interpreters running `COLD_START_COMMANDS`, imports included."""
+    root = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, arguments in COLD_START_COMMANDS.items():
+        results[name] = time_stage(
+            lambda _: subprocess.run([sys.executable, *arguments], cwd=root, capture_output=True, check=True),
+            repeats=repeats
+            )
+    return results
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+            ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def run_benchmarks(
+        resolutions: list,
+        repeats: int,
+        samples_per_image: int,
+        puzzle_complexity: int,
+        encoders: list = DEFAULT_ENCODERS,
+        encoders_only: bool = False,
+        large_boards: list = DEFAULT_LARGE_BOARDS
+        ) -> dict:
+    report = {
+        "environment": environment(),
+        "stages": {},
+        "end_to_end": {},
+        "encoders": {},
+        "large_boards": {},
+        "cold_start": {}
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_folder = os.path.join(tmp_dir, "images")
+        output_folder = os.path.join(tmp_dir, "dataset")
+        os.makedirs(image_folder)
+        os.makedirs(output_folder)
+        image_paths = []
+        for index, resolution in enumerate(resolutions):
+            width, height = (int(value) for value in resolution.split("x"))
+            image_path = os.path.join(image_folder, f"synthetic_{resolution}.jpg")
+            make_synthetic_image(image_path, width, height, seed=index)
+            image_paths.append(image_path)
+
+        for resolution, image_path in zip(resolutions, image_paths):
+            report["encoders"][resolution] = benchmark_encoders(image_path, encoders, repeats, puzzle_complexity)
+            if encoders_only:
+                continue
+            report["stages"][resolution] = benchmark_stages(image_path, output_folder, repeats, puzzle_complexity)
+            report["end_to_end"][resolution] = benchmark_end_to_end(
+                [image_path], output_folder, samples_per_image, puzzle_complexity
+                )
+        if not encoders_only:
+            report["cold_start"] = benchmark_cold_start(repeats)
+        if large_boards and not encoders_only:
+            report["large_boards"] = benchmark_large_boards(
+                image_paths[-1], output_folder, large_boards, 4 * samples_per_image
+                )
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def compare_reports(baseline: dict, current: dict) -> list:
+    """Return one line per stage with the median time ratio current / baseline."""
+    lines = []
+    for resolution, stages in current["stages"].items():
+        for stage, result in stages.items():
+            base = baseline.get("stages", {}).get(resolution, {}).get(stage)
+            if base is None:
+                continue
+            ratio = result["median_ms"] / base["median_ms"] if base["median_ms"] else float("inf")
+            lines.append(
+                f"{resolution:>10} {stage:<24} {base['median_ms']:10.3f} ms -> {result['median_ms']:10.3f} ms  x{ratio:.2f}"
+            )
+    for resolution, result in current["end_to_end"].items():
+        base = baseline.get("end_to_end", {}).get(resolution)
+        if base is not None:
+            lines.append(
+                f"{resolution:>10} {'end_to_end':<24} {base['puzzles_per_second']:10.2f} /s -> "
+                f"{result['puzzles_per_second']:10.2f} /s"
+            )
+    for name, result in current.get("cold_start", {}).items():
+        base = baseline.get("cold_start", {}).get(name)
+        if base is not None:
+            lines.append(
+                f"{name:>10} {'cold_start':<24} {base['median_ms']:10.3f} ms -> {result['median_ms']:10.3f} ms"
+            )
+    for spec, formats in current.get("large_boards", {}).items():
+        for output_format, result in formats.items():
+            base = baseline.get("large_boards", {}).get(spec, {}).get(output_format)
+            if base is not None:
+                lines.append(
+                    f"{spec:>10} {'large_board ' + output_format:<24} {base['puzzles_per_second']:10.2f} /s -> "
+                    f"{result['puzzles_per_second']:10.2f} /s  target {result['target_puzzles_per_second']:.0f} /s"
+                )
+    for resolution, results in current.get("encoders", {}).items():
+        for spec, kinds in results.items():
+            for kind, result in kinds.items():
+                base = baseline.get("encoders", {}).get(resolution, {}).get(spec, {}).get(kind)
+                if base is not None:
+                    lines.append(
+                        f"{resolution:>10} {spec + ' ' + kind:<24} {base['median_ms']:10.3f} ms -> "
+                        f"{result['median_ms']:10.3f} ms  {base['bytes']:>10} B -> {result['bytes']:>10} B"
+                    )
+    return lines
+
+
+def format_encoder_table(report: dict) -> list:
+    """One line per resolution, encoder and image kind with the encode time and size."""
+    lines = []
+    for resolution, results in report["encoders"].items():
+        for spec, kinds in results.items():
+            for kind, result in kinds.items():
+                lines.append(
+                    f"{resolution:>10} {spec:<28} {kind:<7} {result['median_ms']:9.2f} ms "
+                    f"{result['bytes'] / 1024:10.1f} KiB  {8 * result['bytes'] / result['pixels']:6.3f} bit/px"
+                )
+    return lines
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the puzzle generation pipeline.")
+    parser.add_argument("--resolutions", default=",".join(DEFAULT_RESOLUTIONS), help="Comma separated WxH list.")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--samples-per-image", type=int, default=5)
+    parser.add_argument("--puzzle-complexity", type=int, default=2)
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file.")
+    parser.add_argument("--compare", default=None, help="Baseline JSON report to compare against.")
+    parser.add_argument(
+        "--encoders", nargs="+", default=list(DEFAULT_ENCODERS),
+        help="Encoder specs to compare, e.g. png png:compress_level=1 webp bmp."
+        )
+    parser.add_argument(
+        "--encoders-only", action="store_true",
+        help="Only report encode time and bytes per image for each encoder."
+        )
+    parser.add_argument(
+        "--large-boards", nargs="*", default=list(DEFAULT_LARGE_BOARDS),
+        help="Large tilings to run end to end, e.g. 8x8@32:8 for 8x8 tiles on a 32x32 board moving 8 blocks. "
+             "Pass no value to skip them."
+        )
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> None:
+    args = parse_args(argv)
+    report = run_benchmarks(
+        args.resolutions.split(","),
+        args.repeats,
+        args.samples_per_image,
+        args.puzzle_complexity,
+        encoders=args.encoders,
+        encoders_only=args.encoders_only,
+        large_boards=args.large_boards
+        )
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    elif not args.encoders_only:
+        print(json.dumps(report, indent=2))
+    if args.encoders_only:
+        print("\n".join(format_encoder_table(report)))
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\n".join(compare_reports(baseline, report)))
+
+
+if __name__ == "__main__":
+    main()
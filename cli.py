@@ -0,0 +1,53 @@
+"""One entry point for the dataset tools.
+
+Every command is the `main` of one module, which is imported only when that command runs:
+`verify` never loads Pillow, `publish` is the only command that loads `datasets`, and
+listing the commands loads nothing beyond `argparse`. Options are those of the module,
+see `python cli.py <command> --help`.
+
+Example:
+    python cli.py generate --images images --output dataset --workers 32
+    python cli.py verify dataset/metadata.csv
+    python cli.py render-demo --image images/dog.jpg --output demo_solving_puzzle.gif
+    python cli.py publish --data-dir dataset --repo-id Harshnigm/puzzles-for-vision-llm
+"""
+import argparse
+import importlib
+import sys
+
+# Command -> (module whose `main` runs it, help line).
+COMMANDS = {
+    "generate": ("generate_dataset", "Generate the puzzle dataset."),
+    "render-demo": ("interface", "Render the solve animation of a puzzle."),
+    "verify": ("solution_verifier", "Replay solutions against the puzzle boards."),
+    "publish": ("publish_dataset", "Push the dataset to the Hugging Face Hub."),
+    "fetch": ("fetch_images", "Download source images into the local cache."),
+    "tile-store": ("tile_store", "Pre-split source images into a shared tile store."),
+    "benchmark": ("benchmark", "Benchmark the generation pipeline.")
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Puzzle dataset tools.",
+        epilog="Run `python cli.py <command> --help` for the options of a command."
+        )
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+    for command, (_, help_text) in COMMANDS.items():
+        commands.add_parser(command, help=help_text, add_help=False)
+    return parser
+
+
+def main(argv: list = None) -> None:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in COMMANDS:
+        # Prints the help, or the error for a missing or unknown command, and exits.
+        build_parser().parse_args(argv)
+        return
+    command, *command_argv = argv
+    module_name, _ = COMMANDS[command]
+    importlib.import_module(module_name).main(command_argv)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,213 @@
-from collections import deque
+from collections.abc import Mapping
+
+import numpy as np
+
+import instrumentation
+
+# Direction -> (dx, dy). The order is the neighbour order used by the path search.
+DIRECTION_VECTORS = {'up': (0, -1), 'down': (0, 1), 'left': (-1, 0), 'right': (1, 0)}
+EMPTY = -1
 
 class Node:
+    __slots__ = ('x', 'y')
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
-        self.connections = {'up': None, 'down': None, 'left': None, 'right': None}
+
+class Chunk(Node):
+    __slots__ = ('index',)
+    is_chunk = True
+
+    def __init__(self, x, y, index=None):
+        super().__init__(x, y)
+        self.index = index
 
 class Graph:
+    """A width x height board of cells, some of them occupied by chunks.
+
+    Cells are implicit: neighbours are computed from coordinates instead of being stored per
+    node. `occupancy[x, y]` counts the chunks on a cell and `block_ids[x, y]` holds the index
+    of the visible (last in `chunks`) chunk on it, or `EMPTY`. Both grids are kept in sync by
+    `move_chunk`, so chunks must be moved through the graph.
+    """
+
     def __init__(self, width, height, chunk_positions):
-        self.nodes = [[Node(x, y) for y in range(height)] for x in range(width)]
-        self._connect_nodes()
-        self.chunks = [self._create_chunk(x, y) for x, y in chunk_positions]
+        self.width = width
+        self.height = height
+        self.occupancy = np.zeros((width, height), dtype=np.uint8)
+        self.block_ids = np.full((width, height), EMPTY, dtype=np.int16)
+        self.chunks = [self._create_chunk(x, y, index) for index, (x, y) in enumerate(chunk_positions)]
 
     def __str__(self):
         graph_str = ""
-        for y in range(len(self.nodes[0])):
-            for x in range(len(self.nodes)):
-                if any(chunk.x == x and chunk.y == y for chunk in self.chunks):
+        for y in range(self.height):
+            for x in range(self.width):
+                if self.occupancy[x, y]:
                     graph_str += "* "
                 else:
                     graph_str += ". "
             graph_str += "\n"
         return graph_str
 
-    def _connect_nodes(self):
-        for x in range(len(self.nodes)):
-            for y in range(len(self.nodes[x])):
-                node = self.nodes[x][y]
-                if x > 0:
-                    node.connections['left'] = self.nodes[x - 1][y]
-                if x < len(self.nodes) - 1:
-                    node.connections['right'] = self.nodes[x + 1][y]
-                if y > 0:
-                    node.connections['up'] = self.nodes[x][y - 1]
-                if y < len(self.nodes[x]) - 1:
-                    node.connections['down'] = self.nodes[x][y + 1]
-
-    def _create_chunk(self, x, y):
-        chunk = Chunk(x, y)
-        chunk.connections = self.nodes[x][y].connections.copy()
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def is_occupied(self, x, y):
+        return bool(self.occupancy[x, y])
+
+    def chunk_at(self, x, y):
+        """Return the visible chunk on a cell, or None."""
+        block_id = self.block_ids[x, y]
+        return self.chunks[block_id] if block_id != EMPTY else None
+
+    def neighbours(self, x, y):
+        """Yield (direction, (x, y)) for every neighbouring cell on the board."""
+        for direction, (dx, dy) in DIRECTION_VECTORS.items():
+            next_x, next_y = x + dx, y + dy
+            if 0 <= next_x < self.width and 0 <= next_y < self.height:
+                yield direction, (next_x, next_y)
+
+    def move_chunk(self, chunk, direction):
+        """Move a chunk one cell in a direction, updating the occupancy grids."""
+        dx, dy = DIRECTION_VECTORS[direction]
+        if not self.in_bounds(chunk.x + dx, chunk.y + dy):
+            raise ValueError(f"Cannot move chunk at {(chunk.x, chunk.y)} {direction}: off the board")
+        self._remove(chunk)
+        chunk.x, chunk.y = chunk.x + dx, chunk.y + dy
+        self._place(chunk)
+
+    def apply_moves(self, moves):
+        """Apply a batch of (chunk or chunk index, direction) moves in order."""
+        for chunk, direction in moves:
+            if not isinstance(chunk, Chunk):
+                chunk = self.chunks[chunk]
+            self.move_chunk(chunk, direction)
+
+    def positions(self):
+        """Return the chunk positions as a (num_chunks, 2) array of (x, y)."""
+        return np.array([(chunk.x, chunk.y) for chunk in self.chunks], dtype=np.int32).reshape(-1, 2)
+
+    def snapshot(self):
+        """Capture the current state; pass it to `restore` to return to it."""
+        return self.positions()
+
+    def restore(self, snapshot):
+        """Put every chunk back where it was when `snapshot` was taken."""
+        self.occupancy.fill(0)
+        self.block_ids.fill(EMPTY)
+        for chunk, (x, y) in zip(self.chunks, snapshot.tolist()):
+            chunk.x, chunk.y = x, y
+            self._place(chunk)
+
+    def copy(self):
+        """Return an independent graph with new chunks in the same positions."""
+        return Graph(self.width, self.height, [(chunk.x, chunk.y) for chunk in self.chunks])
+
+    def _create_chunk(self, x, y, index):
+        chunk = Chunk(x, y, index)
+        self._place(chunk)
         return chunk
 
-class Chunk(Node):
-    def __init__(self, x, y):
-        super().__init__(x, y)
-        self.is_chunk = True
+    def _place(self, chunk):
+        self.occupancy[chunk.x, chunk.y] += 1
+        if chunk.index > self.block_ids[chunk.x, chunk.y]:
+            self.block_ids[chunk.x, chunk.y] = chunk.index
+
+    def _remove(self, chunk):
+        x, y = chunk.x, chunk.y
+        self.occupancy[x, y] -= 1
+        if self.occupancy[x, y] == 0:
+            self.block_ids[x, y] = EMPTY
+        elif self.block_ids[x, y] == chunk.index:
+            # Chunks may overlap when paths ignore each other; find the next visible one.
+            self.block_ids[x, y] = max(
+                (other.index for other in self.chunks
+                 if other is not chunk and other.x == x and other.y == y),
+                default=EMPTY
+                )
+
+class EmptyBoardPaths:
+    """Shortest paths between any two cells of an empty width x height board.
+
+    On an empty board a breadth-first search expanding neighbours in `DIRECTION_VECTORS`
+    order always ends up with the vertical moves first and the horizontal moves second, so
+    the path only depends on the offset between the cells. Paths are built on demand and
+    kept in a table keyed by that offset, which makes every later lookup a dict access and
+    lets the table be shared by all puzzles on boards of the same size.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._paths_by_offset = {}
+
+    def distance(self, start, end):
+        return abs(end[0] - start[0]) + abs(end[1] - start[1])
+
+    def path(self, start, end):
+        """Return the moves from `start` to `end` as a tuple of directions, or None."""
+        if not (0 <= end[0] < self.width and 0 <= end[1] < self.height):
+            return None
+        offset = (end[0] - start[0], end[1] - start[1])
+        path = self._paths_by_offset.get(offset)
+        if path is None:
+            dx, dy = offset
+            path = (('up',) * -dy if dy < 0 else ('down',) * dy) + \
+                (('left',) * -dx if dx < 0 else ('right',) * dx)
+            self._paths_by_offset[offset] = path
+        return path
+
+_EMPTY_BOARD_PATHS = {}
+
+def get_empty_board_paths(width, height):
+    """Return the process wide `EmptyBoardPaths` table for a board size."""
+    table = _EMPTY_BOARD_PATHS.get((width, height))
+    if table is None:
+        table = _EMPTY_BOARD_PATHS[(width, height)] = EmptyBoardPaths(width, height)
+    return table
+
+class ChunkPaths(Mapping):
+    """Read-only mapping of end cell -> path for one start cell, built lazily on lookup."""
+
+    def __init__(self, table, start):
+        self.table = table
+        self.start = start
+
+    def __getitem__(self, end):
+        path = self.table.path(self.start, end)
+        if path is None:
+            raise KeyError(end)
+        return list(path)
+
+    def __contains__(self, end):
+        return 0 <= end[0] < self.table.width and 0 <= end[1] < self.table.height
+
+    def __iter__(self):
+        return ((x, y) for x in range(self.table.width) for y in range(self.table.height))
+
+    def __len__(self):
+        return self.table.width * self.table.height
 
 class PathFinder:
+    """Shortest paths for the chunks of a graph, ignoring the other chunks."""
+
     def __init__(self, graph):
         self.graph = graph
+        self.table = get_empty_board_paths(graph.width, graph.height)
         self.paths = {}
 
     def find_paths(self):
+        """Fill `paths[start][end]` for every chunk; paths are only built when looked up."""
         for chunk in self.graph.chunks:
-            self.paths[(chunk.x, chunk.y)] = self._find_paths_from_chunk(chunk)
+            self.paths[(chunk.x, chunk.y)] = ChunkPaths(self.table, (chunk.x, chunk.y))
             # break
 
-    def _find_paths_from_chunk(self, chunk):
-        queue = deque([(chunk, [])])
-        paths = {}
-        visited = set()
-
-        while queue:
-            current_chunk, current_path = queue.popleft()
-            current_key = (current_chunk.x, current_chunk.y)
-
-            if current_key in visited:
-                continue
-
-            visited.add(current_key)
-
-            for direction, next_node in current_chunk.connections.items():
-                if next_node is None:
-                    continue
-
-                next_key = (next_node.x, next_node.y)
-                new_path = current_path + [direction]
-
-                if next_key not in paths or len(new_path) < len(paths[next_key]):
-                    paths[next_key] = new_path
-                    queue.append((next_node, new_path))
-
-        return paths
+    def find_path(self, start, end):
+        """Return the list of moves from `start` to `end`, or None if `end` is off the board."""
+        instrumentation.count("path_lookups")
+        path = self.table.path(start, end)
+        return list(path) if path is not None else None
 
     # def _find_paths_from_chunk(self, chunk, path, visited):
     #     visited.add((chunk.x, chunk.y))
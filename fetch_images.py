@@ -0,0 +1,276 @@
+"""Concurrent download of source images into a content-addressed local cache.
+
+Image lists come from a COCO annotation file (its `images` entries, optionally restricted
+to some categories) or from a URL manifest: a text file with one URL per line, or a JSON /
+JSONL file of objects with `url` and optional `file_name`. Downloads run on a thread pool
+sharing one `requests.Session`, whose connection pool is sized to the number of threads
+and which retries connection errors and 429/5xx responses with exponential backoff.
+
+Every file is streamed to a temporary file while it is hashed and then renamed to
+`<cache>/objects/<sha[:2]>/<sha>`, so the cache never holds partial files. The URLs already
+fetched are recorded in `<cache>/index.jsonl`; they are skipped on the next run without a
+request. Each image is then linked (or copied, where hard links are not possible) into
+the images folder under its file name, where `generate_dataset.py` picks it up.
+
+Example:
+    python fetch_images.py --coco annotations/instances_val2017.json --limit 200 --images images
+    python fetch_images.py --urls urls.txt --images images --workers 64
+"""
+import argparse
+import filecmp
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import typing
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "puzzle_dataset", "images")
+INDEX_FILE = "index.jsonl"
+OBJECTS_FOLDER = "objects"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class ImageSource(typing.NamedTuple):
+    url: str
+    file_name: str
+
+
+def _file_name_from_url(url: str) -> str:
+    return os.path.basename(urllib.parse.urlparse(url).path) or hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+
+
+def read_coco_sources(
+        annotation_path: str,
+        categories: typing.List[str] = None,
+        url_field: str = "coco_url"
+        ) -> typing.List[ImageSource]:
+    """The images of a COCO annotation file, only those showing one of `categories` if given."""
+    with open(annotation_path) as f:
+        annotations = json.load(f)
+    images = annotations["images"]
+    if categories:
+        wanted = {category["id"] for category in annotations.get("categories", []) if category["name"] in categories}
+        image_ids = {
+            annotation["image_id"] for annotation in annotations.get("annotations", [])
+            if annotation["category_id"] in wanted
+        }
+        images = [image for image in images if image["id"] in image_ids]
+    return [
+        ImageSource(image.get(url_field) or image["coco_url"], image["file_name"])
+        for image in images
+    ]
+
+
+def read_url_manifest(path: str) -> typing.List[ImageSource]:
+    """The images of a URL manifest: plain URLs, a JSON list or JSON lines."""
+    with open(path) as f:
+        text = f.read()
+    stripped = text.lstrip()
+    if stripped.startswith("["):
+        entries = json.loads(stripped)
+    elif stripped.startswith("{"):
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        entries = [line.strip() for line in text.splitlines() if line.strip() and not line.startswith("#")]
+    sources = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        sources.append(ImageSource(entry["url"], entry.get("file_name") or _file_name_from_url(entry["url"])))
+    return sources
+
+
+def create_session(pool_size: int = 16, retries: int = 5, backoff_factor: float = 0.5) -> requests.Session:
+    """A session whose connection pool fits `pool_size` threads and that retries transient errors."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True
+        )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class ImageCache:
+    """Content-addressed store of downloaded files plus the index of the URLs they came from."""
+
+    def __init__(self, cache_folder: str = DEFAULT_CACHE) -> None:
+        self.cache_folder = cache_folder
+        self.objects_folder = os.path.join(cache_folder, OBJECTS_FOLDER)
+        os.makedirs(self.objects_folder, exist_ok=True)
+        self.index_path = os.path.join(cache_folder, INDEX_FILE)
+        self.hashes = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.hashes[entry["url"]] = entry["sha256"]
+        self._lock = threading.Lock()
+        # mkstemp creates files readable by the owner only; cached files get the usual mode.
+        umask = os.umask(0)
+        os.umask(umask)
+        self._file_mode = 0o666 & ~umask
+
+    def object_path(self, content_hash: str) -> str:
+        return os.path.join(self.objects_folder, content_hash[:2], content_hash)
+
+    def lookup(self, url: str) -> typing.Optional[str]:
+        """Path of the cached content of `url`, or None if it was never fetched."""
+        content_hash = self.hashes.get(url)
+        if content_hash is None:
+            return None
+        path = self.object_path(content_hash)
+        return path if os.path.exists(path) else None
+
+    def store(self, url: str, chunks: typing.Iterable[bytes]) -> str:
+        """Write `chunks` into the cache under their SHA-256 and record `url`; returns the path."""
+        digest = hashlib.sha256()
+        descriptor, tmp_path = tempfile.mkstemp(dir=self.objects_folder, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+            os.chmod(tmp_path, self._file_mode)
+            content_hash = digest.hexdigest()
+            path = self.object_path(content_hash)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self.hashes[url] = content_hash
+            with open(self.index_path, "a") as f:
+                f.write(json.dumps({"url": url, "sha256": content_hash}) + "\n")
+        return path
+
+
+def fetch_image(session: requests.Session, cache: ImageCache, url: str, timeout: float = 30.0) -> typing.Tuple[str, bool]:
+    """Return the cached path of `url` and whether it had to be downloaded."""
+    path = cache.lookup(url)
+    if path is not None:
+        return path, False
+    with session.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        return cache.store(url, response.iter_content(chunk_size=1 << 16)), True
+
+
+def _same_content(path: str, other_path: str) -> bool:
+    return os.path.samefile(path, other_path) or filecmp.cmp(path, other_path, shallow=False)
+
+
+def link_into(path: str, destination: str) -> str:
+    """Place the cached file at `destination`, as a hard link when possible; returns its path.
+
+    When another file already has that name, e.g. `photo.jpg` from two hosts, the file is
+    placed as `<name>-<content hash prefix><extension>` next to it instead.
+    """
+    if os.path.exists(destination):
+        if _same_content(path, destination):
+            return destination
+        stem, extension = os.path.splitext(destination)
+        # Cache objects are named by their SHA-256.
+        destination = f"{stem}-{os.path.basename(path)[:12]}{extension}"
+        if os.path.exists(destination):
+            return destination
+    tmp_destination = f"{destination}.tmp"
+    try:
+        os.link(path, tmp_destination)
+    except OSError:
+        shutil.copyfile(path, tmp_destination)
+    os.replace(tmp_destination, destination)
+    return destination
+
+
+def fetch_images(
+        sources: typing.List[ImageSource],
+        images_folder: str,
+        cache: ImageCache,
+        workers: int = 16,
+        retries: int = 5,
+        timeout: float = 30.0
+        ) -> dict:
+    """Fetch every source into `cache` and `images_folder` on `workers` threads.
+
+    Failed downloads are reported, not raised, so one bad URL does not stop a large run.
+    Returns the counts of `downloaded`, `cached` and `failed` images plus the `errors`, and
+    in `renamed` the URLs placed under another name because their file name was taken.
+    """
+    os.makedirs(images_folder, exist_ok=True)
+    session = create_session(pool_size=workers, retries=retries)
+    stats = {"downloaded": 0, "cached": 0, "failed": 0, "errors": {}, "renamed": {}}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch") as executor, \
+            tqdm(total=len(sources), unit="image") as progress:
+        futures = {executor.submit(fetch_image, session, cache, source.url, timeout): source for source in sources}
+        for future in as_completed(futures):
+            source = futures[future]
+            progress.update(1)
+            try:
+                path, downloaded = future.result()
+            except (requests.RequestException, OSError) as error:
+                stats["failed"] += 1
+                stats["errors"][source.url] = str(error)
+                continue
+            destination = link_into(path, os.path.join(images_folder, source.file_name))
+            if os.path.basename(destination) != source.file_name:
+                stats["renamed"][source.url] = os.path.basename(destination)
+            stats["downloaded" if downloaded else "cached"] += 1
+    session.close()
+    return stats
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Download source images into a local content-addressed cache.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--coco", default=None, help="COCO annotation JSON whose images are fetched.")
+    source.add_argument("--urls", default=None, help="URL manifest: one URL per line, a JSON list or JSON lines.")
+    parser.add_argument("--categories", default=None, help="Comma separated COCO category names to keep.")
+    parser.add_argument(
+        "--url-field", default="coco_url",
+        help="Field of the COCO image entries holding the URL, e.g. flickr_url."
+        )
+    parser.add_argument("--limit", type=int, default=None, help="Fetch at most this many images.")
+    parser.add_argument("--images", default="images", help="Folder the images are placed in.")
+    parser.add_argument("--cache", default=DEFAULT_CACHE, help="Content-addressed download cache.")
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent downloads.")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds per request.")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> None:
+    args = parse_args(argv)
+    if args.coco is not None:
+        categories = args.categories.split(",") if args.categories else None
+        sources = read_coco_sources(args.coco, categories, args.url_field)
+    else:
+        sources = read_url_manifest(args.urls)
+    if args.limit is not None:
+        sources = sources[:args.limit]
+    stats = fetch_images(sources, args.images, ImageCache(args.cache), args.workers, args.retries, args.timeout)
+    print(f"Downloaded {stats['downloaded']}, already cached {stats['cached']}, failed {stats['failed']}.")
+    for url, error in sorted(stats["errors"].items())[:10]:
+        print(f"  {url}: {error}")
+    if stats["renamed"]:
+        print(f"Renamed {len(stats['renamed'])} images whose file name was taken by another image.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Incremental rendering of solve frames.
+
+`ImageGraph._generate_updated_image_with_instructions` recomposes the whole canvas for
+every state. `FrameRenderer` composes it once and then, for each move, only repaints the
+cell the block left, the cell it entered and the new line of the instruction panel.
+"""
+import functools
+import typing
+import warnings
+
+from PIL import Image, ImageDraw, ImageFont
+
+import instrumentation
+
+INSTRUCTION_PANEL_WIDTH = 200
+INSTRUCTION_FONT_SIZE = 20
+INSTRUCTION_LINE_HEIGHT = 20
+INSTRUCTION_TOP_MARGIN = 10
+INSTRUCTION_LEFT_MARGIN = 10
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(size: int, name: str = "arial.ttf") -> ImageFont.ImageFont:
+    """Load a TrueType font once per process, falling back to PIL's default font."""
+    try:
+        return ImageFont.truetype(name, size)
+    except IOError:
+        warnings.warn(f"Font {name} not found. Using PIL's load_default() font.")
+        instrumentation.count("font_fallbacks")
+        return ImageFont.load_default()
+
+
+class FrameRenderer:
+    """Keeps one canvas of an `ImageGraph` and updates it move by move.
+
+    Frames are the same images `_generate_updated_image_with_instructions` produces for
+    the unlabelled board, with the instruction panel on the left when `instruction_mode`
+    is set.
+    """
+
+    def __init__(self, image_graph, instruction_mode: bool = True) -> None:
+        self.image_graph = image_graph
+        self.instruction_mode = instruction_mode
+        self.instructions = []
+        self.canvas = image_graph._generate_updated_image_with_instructions(
+            self.instructions,
+            instruction_mode=instruction_mode
+            )
+        self.board_offset = INSTRUCTION_PANEL_WIDTH if instruction_mode else 0
+        self._draw = ImageDraw.Draw(self.canvas)
+        self._font = load_font(INSTRUCTION_FONT_SIZE)
+
+    def apply_move(self, chunk, direction: str, instruction: str = None) -> None:
+        """Move `chunk` one cell and repaint only what changed."""
+        previous_cell = (chunk.x, chunk.y)
+        self.image_graph._move_chunk(chunk, direction)
+        self._repaint_cell(previous_cell)
+        self._repaint_cell((chunk.x, chunk.y))
+        if instruction is not None:
+            self._append_instruction(instruction)
+
+    def frames(
+            self,
+            moves: typing.Iterable[typing.Tuple[typing.Any, str, str]],
+            copy_frames: bool = True
+            ) -> typing.Iterator[Image.Image]:
+        """Yield the current frame and then one frame per `(chunk, direction, instruction)` move.
+
+        With `copy_frames` off the same canvas object is yielded every time, which is only
+        safe when each frame is consumed before the next one is requested.
+        """
+        yield self.canvas.copy() if copy_frames else self.canvas
+        for chunk, direction, instruction in moves:
+            self.apply_move(chunk, direction, instruction)
+            instrumentation.count("frames_rendered")
+            yield self.canvas.copy() if copy_frames else self.canvas
+
+    def _repaint_cell(self, cell: typing.Tuple[int, int]) -> None:
+        chunk_width, chunk_height = self.image_graph.chunk_size
+        box = (self.board_offset + cell[0] * chunk_width, cell[1] * chunk_height)
+        chunk = self.image_graph.graph.chunk_at(*cell)
+        if chunk is not None:
+            self.canvas.paste(self.image_graph.tiles[chunk.index], box)
+        else:
+            self.canvas.paste((0, 0, 0), box + (box[0] + chunk_width, box[1] + chunk_height))
+
+    def _append_instruction(self, instruction: str) -> None:
+        y_position = INSTRUCTION_TOP_MARGIN + len(self.instructions) * INSTRUCTION_LINE_HEIGHT
+        self.instructions.append(instruction)
+        if self.instruction_mode:
+            self._draw.text(
+                (INSTRUCTION_LEFT_MARGIN, y_position),
+                instruction,
+                fill='black',
+                font=self._font
+                )
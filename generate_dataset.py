@@ -0,0 +1,706 @@
+"""Parallel, sharded generation of the puzzle dataset.
+
+Every source image is an independent unit of work: it gets its own seed derived from
+the base seed and the image file name, so the puzzles produced for an image do not
+depend on the number of workers or on which machine processes it. Images are assigned
+to shards by a hash of their file name, which lets several machines each take a slice
+of `images/` with `--num-shards` / `--shard-index`.
+
+Example:
+    python generate_dataset.py --images images --output dataset --workers 32
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import random
+from multiprocessing import Pool, util
+
+import instrumentation
+from graph_embedding import ImageGraph
+from image_encoders import get_encoder
+from io_pipeline import AsyncSampleWriter, Prefetcher
+from manifest import Manifest, file_content_hash, open_manifest_writer, puzzle_id, source_entry
+from metadata_writer import MetadataWriter, merge_metadata
+from multi_block_planner import PlannerStats, PlanningError, PrioritizedPlanner
+from puzzle_index import BloomFilter, PuzzleIndex, canonical_puzzle_key
+from puzzle_sampler import CHUNK_SELECTIONS, PuzzleSampler
+from sample_writer import FolderSampleWriter, TarShardWriter, write_shard_index
+from tensor_export import TensorWriter, merge_tensor_parts
+from tile_cache import TileCache
+from tile_store import TileStore
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Per worker process state, created by `_init_worker`.
+_metadata_writer = None
+_tile_cache = None
+_tile_store = None
+_sample_writer = None
+_tensor_writer = None
+_manifest_writer = None
+_completed = {}
+_puzzle_index = None
+
+
+class GenerationConfig:
+
+    def __init__(
+            self,
+            output_folder: str = "dataset",
+            num_samples_per_image: int = 5,
+            graph_size: int = 11,
+            tiles_per_side: int = 3,
+            chunk_selection: str = None,
+            puzzle_complexity: int = 2,
+            puzzle_distance_thr: int = 3,
+            seed: int = 0,
+            tile_cache_size: int = 4,
+            tile_cache_max_bytes: int = None,
+            max_tile_size: int = None,
+            tile_store: str = None,
+            output_format: str = "folder",
+            encoder: str = "png",
+            shard_max_bytes: int = 256 * 1024 * 1024,
+            shard_max_samples: int = None,
+            animation_folder: str = None,
+            animation_format: str = "gif",
+            animation_frame_duration: int = 700,
+            planner: str = "prioritized",
+            planner_max_nodes: int = 100_000,
+            planner_time_budget: float = None,
+            max_attempts: int = 100,
+            dedupe: str = "exact",
+            io_threads: int = 0,
+            max_pending_writes: int = 16,
+            prefetch: int = 0,
+            bloom_error_rate: float = 1e-4,
+            profile: bool = False,
+            trace: bool = False
+            ) -> None:
+        self.output_folder = output_folder
+        self.num_samples_per_image = num_samples_per_image
+        self.graph_size = graph_size
+        self.tiles_per_side = tiles_per_side
+        # Uniform draws wall chunks in on larger tilings, see `PuzzleSampler`.
+        if chunk_selection is None:
+            chunk_selection = "uniform" if tiles_per_side == 3 else "frontier"
+        self.chunk_selection = chunk_selection
+        self.puzzle_complexity = puzzle_complexity
+        self.puzzle_distance_thr = puzzle_distance_thr
+        self.seed = seed
+        self.tile_cache_size = tile_cache_size
+        self.tile_cache_max_bytes = tile_cache_max_bytes
+        self.max_tile_size = max_tile_size
+        self.tile_store = tile_store
+        self.output_format = output_format
+        self.encoder = encoder
+        self.shard_max_bytes = shard_max_bytes
+        self.shard_max_samples = shard_max_samples
+        self.animation_folder = animation_folder
+        self.animation_format = animation_format
+        self.animation_frame_duration = animation_frame_duration
+        self.planner = planner
+        self.planner_max_nodes = planner_max_nodes
+        self.planner_time_budget = planner_time_budget
+        self.max_attempts = max_attempts
+        self.dedupe = dedupe
+        self.io_threads = io_threads
+        self.max_pending_writes = max_pending_writes
+        self.prefetch = prefetch
+        self.bloom_error_rate = bloom_error_rate
+        self.profile = profile
+        self.trace = trace
+
+    def fingerprint(self) -> str:
+        """Hash of the settings that shape the puzzles, part of every puzzle id."""
+        settings = {
+            "graph_size": self.graph_size,
+            "puzzle_complexity": self.puzzle_complexity,
+            "puzzle_distance_thr": self.puzzle_distance_thr,
+            "seed": self.seed,
+            "planner": self.planner
+        }
+        if self.max_tile_size is not None:
+            # Only present when set, so fingerprints of full resolution runs stay the same.
+            settings["max_tile_size"] = self.max_tile_size
+        if self.tiles_per_side != 3:
+            settings["tiles_per_side"] = self.tiles_per_side
+        if self.chunk_selection != "uniform":
+            settings["chunk_selection"] = self.chunk_selection
+        if self.output_format == "tensors":
+            # Tensor puzzles have no image, so they never count as done for an image run.
+            settings["image_format"] = "tensors"
+        else:
+            image_format = get_encoder(self.encoder).image_format
+            if image_format != "png":
+                settings["image_format"] = image_format
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def derive_seed(base_seed: int, *parts) -> int:
+    """Derive a stable 64 bit seed from the base seed and any number of key parts.
+
+    Python's built-in `hash` is salted per process, so a digest is used instead to keep
+    seeds identical across workers and machines.
+    """
+    key = ":".join(str(part) for part in (base_seed,) + parts)
+    return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+
+
+def list_source_images(directory_path: str) -> list:
+    """Return the sorted list of image paths under `directory_path`."""
+    file_names = sorted(
+        filename for filename in os.listdir(directory_path)
+        if filename.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return [os.path.join(directory_path, filename) for filename in file_names]
+
+
+def select_shard(image_paths: list, num_shards: int, shard_index: int) -> list:
+    """Keep the images that belong to `shard_index`.
+
+    The assignment only depends on the file name, so adding images to the source folder
+    does not move already generated images to another shard.
+    """
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"shard_index {shard_index} is out of range for {num_shards} shards")
+    return [
+        image_path for image_path in image_paths
+        if derive_seed(0, "shard", os.path.basename(image_path)) % num_shards == shard_index
+    ]
+
+
+def _init_worker(
+        config: GenerationConfig,
+        part_prefix: str,
+        completed: dict = None,
+        puzzle_index=None
+        ) -> None:
+    global _metadata_writer, _tile_cache, _tile_store, _sample_writer, _tensor_writer, _manifest_writer, _completed, _puzzle_index
+    _metadata_writer = MetadataWriter(
+        config.output_folder,
+        part_name=f"{part_prefix}-{os.getpid()}"
+        )
+    _manifest_writer = open_manifest_writer(config.output_folder, part_name=f"{part_prefix}-{os.getpid()}")
+    _completed = completed if completed is not None else {}
+    _puzzle_index = puzzle_index
+    _tile_cache = TileCache(max_entries=config.tile_cache_size, max_bytes=config.tile_cache_max_bytes)
+    if config.tile_store is not None:
+        # Mapped once per worker; the pages are shared with every other worker.
+        _tile_store = TileStore(config.tile_store)
+    encoder = get_encoder(config.encoder)
+    if config.output_format == "tensors":
+        _tensor_writer = TensorWriter(
+            config.output_folder,
+            graph_size=config.graph_size,
+            part_name=f"{part_prefix}-{os.getpid()}",
+            manifest=_manifest_writer
+            )
+        util.Finalize(_tensor_writer, _tensor_writer.close, exitpriority=10)
+    elif config.output_format == "tar":
+        _sample_writer = TarShardWriter(
+            config.output_folder,
+            metadata=_metadata_writer,
+            manifest=_manifest_writer,
+            encoder=encoder,
+            max_shard_bytes=config.shard_max_bytes,
+            max_shard_samples=config.shard_max_samples
+            )
+    else:
+        _sample_writer = FolderSampleWriter(
+            config.output_folder,
+            _metadata_writer,
+            manifest=_manifest_writer,
+            encoder=encoder
+            )
+    if _sample_writer is not None:
+        if config.io_threads > 0:
+            _sample_writer = AsyncSampleWriter(_sample_writer, config.io_threads, config.max_pending_writes)
+        # Finish queued writes and the open shard when the pool shuts the worker down.
+        util.Finalize(_sample_writer, _sample_writer.close, exitpriority=10)
+    # Run after the sample writer, which may still append records and manifest entries.
+    util.Finalize(_metadata_writer, _metadata_writer.close, exitpriority=5)
+    util.Finalize(_manifest_writer, _manifest_writer.close, exitpriority=5)
+    if config.profile or config.trace:
+        instrumentation.enable(trace=config.trace)
+
+
+def sample_puzzle(
+        image_graph: ImageGraph,
+        config: GenerationConfig,
+        puzzle_sampler: PuzzleSampler,
+        planner: PrioritizedPlanner,
+        source_hash: str = "",
+        puzzle_index=None,
+        accept_key: str = None
+        ) -> tuple:
+    """Draw the chunks to displace and their end cells, and plan how to get them there.
+
+    Draws that cannot be completed, that the planner cannot solve or whose canonical key is
+    already in `puzzle_index` are discarded and drawn again, up to `config.max_attempts`
+    times. A draw whose key is `accept_key` passes the index: it is the puzzle a replay must
+    draw again. Nothing is rendered before a draw is accepted. Returns `(chunk_block_map,
+    chunk_instructions, puzzle_key)`.
+    """
+    for _ in range(config.max_attempts):
+        instrumentation.count("puzzle_draws")
+        image_graph.reset()
+        graph = image_graph.graph
+        sampled_chunks_for_displacement = puzzle_sampler.sample_chunks_for_shuffle(graph)
+        chunk_block_map = puzzle_sampler.map_chunks_to_block_names(graph)
+
+        try:
+            end_coords = puzzle_sampler.sample_end_coords(graph, sampled_chunks_for_displacement)
+        except ValueError:
+            continue
+        chunk_to_end_coord_map = puzzle_sampler.map_chunks_to_indices(
+            sampled_chunks_for_displacement,
+            end_coords
+            )
+        puzzle_key = canonical_puzzle_key(
+            source_hash,
+            config.graph_size,
+            [((chunk.x, chunk.y), end_coord) for chunk, end_coord in chunk_to_end_coord_map.items()]
+            )
+        if puzzle_index is not None and puzzle_key != accept_key and puzzle_key in puzzle_index:
+            instrumentation.count("duplicates_rejected")
+            continue
+
+        if config.planner == "legacy":
+            chunk_instructions = image_graph.get_paths_per_chunks(
+                sampled_chunks_for_displacement,
+                chunk_to_end_coord_map
+                )
+            return chunk_block_map, chunk_instructions, puzzle_key
+        try:
+            chunk_instructions = image_graph.plan_moves(
+                sampled_chunks_for_displacement,
+                chunk_to_end_coord_map,
+                planner
+                )
+        except PlanningError:
+            continue
+        return chunk_block_map, chunk_instructions, puzzle_key
+    raise PlanningError(f"No solvable puzzle found in {config.max_attempts} draws")
+
+
+def generate_puzzles_for_image(
+        image_path: str,
+        config: GenerationConfig,
+        metadata=None,
+        sample_writer=None,
+        completed: dict = None,
+        puzzle_index=None,
+        image_graph: ImageGraph = None,
+        tensor_writer: TensorWriter = None
+        ) -> tuple:
+    """Generate `config.num_samples_per_image` puzzles for one source image.
+
+    Metadata records are appended to `metadata` and puzzle images go to `sample_writer`;
+    both default to the writers of the current worker process. Puzzles whose id is in
+    `completed` (puzzle ids and their recorded keys, by default those of the manifest loaded
+    when the run started) are drawn again to
+    keep the random stream in step, but not rendered or written. New puzzles already in
+    `puzzle_index` (by default the index of the worker) are redrawn. `image_graph` is the
+    already decoded image, if any. Returns the number of generated puzzles and the planner
+    statistics of the image.
+
+    With `config.output_format == "tensors"`, nothing is rendered: the board and solution
+    of every puzzle go to `tensor_writer`, by default the one of the worker, or else a writer
+    that is closed before this returns.
+    """
+    tensors = config.output_format == "tensors"
+    if metadata is None:
+        metadata = _metadata_writer
+    if tensors:
+        if tensor_writer is None:
+            tensor_writer = _tensor_writer
+        if tensor_writer is None:
+            # Outside a worker the writer lives for this call only, so it is closed here.
+            with TensorWriter(config.output_folder, graph_size=config.graph_size) as tensor_writer:
+                return generate_puzzles_for_image(
+                    image_path,
+                    config,
+                    metadata=metadata,
+                    completed=completed,
+                    puzzle_index=puzzle_index,
+                    image_graph=image_graph,
+                    tensor_writer=tensor_writer
+                    )
+    else:
+        if sample_writer is None:
+            sample_writer = _sample_writer
+        if sample_writer is None:
+            sample_writer = FolderSampleWriter(config.output_folder, metadata, encoder=get_encoder(config.encoder))
+    if completed is None:
+        completed = _completed
+    if puzzle_index is None and config.dedupe != "off":
+        # Keys include the source hash, so an index of this image alone catches its duplicates.
+        puzzle_index = _puzzle_index if _puzzle_index is not None else PuzzleIndex()
+    content_hash = file_content_hash(image_path)
+    fingerprint = config.fingerprint()
+    filename = os.path.basename(image_path)
+    puzzle_ids = [puzzle_id(content_hash, filename, fingerprint, i) for i in range(config.num_samples_per_image)]
+    if all(puzzle in completed for puzzle in puzzle_ids):
+        return 0, PlannerStats()
+    source = source_entry(image_path, content_hash)
+    rng = random.Random(derive_seed(config.seed, filename))
+    planner = PrioritizedPlanner(
+        max_nodes=config.planner_max_nodes,
+        time_budget=config.planner_time_budget,
+        rng=rng
+        )
+    # One sampler per image, so the puzzles of an image are drawn without replacement.
+    puzzle_sampler = PuzzleSampler(
+        graph_size=config.graph_size,
+        puzzle_complexity=config.puzzle_complexity,
+        puzzle_distance_thr=config.puzzle_distance_thr,
+        rng=rng,
+        chunk_selection=config.chunk_selection
+        )
+    # The image is decoded once; every puzzle starts from a reset board on the same tiles.
+    if image_graph is None:
+        image_graph = _load_image_graph(image_path, config, _tile_cache)
+
+    num_generated = 0
+    for i in range(config.num_samples_per_image):
+        replay = puzzle_ids[i] in completed
+        with instrumentation.span("sample_puzzle"):
+            chunk_block_map, chunk_instructions, puzzle_key = sample_puzzle(
+                image_graph,
+                config,
+                puzzle_sampler,
+                planner,
+                source_hash=content_hash,
+                puzzle_index=puzzle_index,
+                # A replayed puzzle is in the index already; its own key must still be accepted
+                # while the draws the original run rejected are rejected again.
+                accept_key=completed.get(puzzle_ids[i]) if replay else None
+                )
+        if puzzle_index is not None:
+            puzzle_index.add(puzzle_key)
+        if replay:
+            instrumentation.count("puzzles_skipped")
+            continue
+        image_name = f"{os.path.splitext(filename)[0]}_{i}"
+        manifest_entry = {
+            "puzzle_id": puzzle_ids[i],
+            "puzzle_key": puzzle_key,
+            "index": i,
+            **source
+        }
+        if tensors:
+            shuffle = image_graph.shuffle_chunks(chunk_instructions, chunk_block_map)
+            goals = [shuffle["goals"][chunk_block_map[chunk]] for chunk in image_graph.graph.chunks]
+            tensor_writer.append(image_name, image_graph.graph, goals, shuffle["moves"], manifest_entry)
+            num_generated += 1
+            continue
+        data_point = image_graph.generate_data_point(
+            chunk_instructions,
+            config.output_folder,
+            image_name,
+            chunk_block_map,
+            metadata,
+            sample_writer,
+            manifest_entry={**manifest_entry, "file_name": f"{image_name}.{sample_writer.extension}"}
+            )
+        num_generated += 1
+        if config.animation_folder is not None:
+            extension = "gif" if config.animation_format == "gif" else "png"
+            # Imported on demand: it loads Pillow's GIF plugin, which most runs never use.
+            from animation import render_solve_animation
+            with instrumentation.span("animation"):
+                render_solve_animation(
+                    image_graph,
+                    data_point["moves"],
+                    chunk_block_map,
+                    os.path.join(config.animation_folder, f"{image_name}.{extension}"),
+                    start_image=data_point["start_image"],
+                    animation_format=config.animation_format,
+                    duration=config.animation_frame_duration
+                    )
+    if not tensors:
+        # Make the records written so far durable before the next image starts. The tensor
+        # writer flushes whole parts instead and lists their puzzles in the manifest then.
+        sample_writer.flush()
+    return num_generated, planner.stats
+
+
+def _load_image_graph(image_path: str, config: GenerationConfig, tile_cache: TileCache = None) -> ImageGraph:
+    return ImageGraph(
+        image_path,
+        graph_size=config.graph_size,
+        tiles_per_side=config.tiles_per_side,
+        tile_cache=tile_cache,
+        max_tile_size=config.max_tile_size,
+        decode=config.output_format != "tensors",
+        tile_store=_tile_store
+        )
+
+
+def _generate_image_task(image_path: str, config: GenerationConfig) -> tuple:
+    """Pool task: `generate_puzzles_for_image` plus what the worker recorded meanwhile.
+
+    Returns `(num_images, num_puzzles, planner_stats, profile)`.
+    """
+    with instrumentation.span("image"):
+        num_puzzles, planner_stats = generate_puzzles_for_image(image_path, config)
+    profile = instrumentation.collect() if instrumentation.is_enabled() else None
+    return 1, num_puzzles, planner_stats, profile
+
+
+def _generate_batch_task(image_paths: list, config: GenerationConfig) -> tuple:
+    """Pool task for a batch of images, decoding up to `config.prefetch` images ahead.
+
+    Prefetched images bypass the tile cache, which is not shared with the prefetch thread.
+    """
+    num_puzzles = 0
+    planner_stats = PlannerStats()
+    loader = functools.partial(_load_image_graph, config=config)
+    for image_path, image_graph in Prefetcher(image_paths, loader, depth=config.prefetch):
+        with instrumentation.span("image"):
+            image_puzzles, image_planner_stats = generate_puzzles_for_image(
+                image_path,
+                config,
+                image_graph=image_graph
+                )
+        num_puzzles += image_puzzles
+        planner_stats.merge(image_planner_stats)
+    profile = instrumentation.collect() if instrumentation.is_enabled() else None
+    return len(image_paths), num_puzzles, planner_stats, profile
+
+
+def generate_dataset(
+        image_paths: list,
+        config: GenerationConfig,
+        workers: int = None,
+        chunksize: int = 4,
+        part_prefix: str = "metadata",
+        profiles: dict = None,
+        resume: bool = True
+        ) -> tuple:
+    """Generate puzzles for all `image_paths` over a process pool.
+
+    Each worker streams its metadata into its own part file. Returns the number of puzzles
+    and the merged `PlannerStats`, as a tuple. With `config.profile` or `config.trace`, the
+    instrumentation snapshots of the workers are merged into `profiles`, keyed by pid.
+
+    With `resume`, puzzles listed in the manifest of the output folder are not generated
+    again, and unchanged images whose puzzles are all listed are not even dispatched. Their
+    canonical keys also seed the duplicate index (`config.dedupe`) handed to the workers.
+    """
+    if config.output_format == "tensors" and config.animation_folder is not None:
+        raise ValueError("Animations need rendered puzzles and are not available with tensor output")
+    os.makedirs(config.output_folder, exist_ok=True)
+    if config.animation_folder is not None:
+        os.makedirs(config.animation_folder, exist_ok=True)
+    completed = {}
+    puzzle_keys = set()
+    if resume:
+        manifest = Manifest(config.output_folder)
+        completed = manifest.completed
+        puzzle_keys = manifest.puzzle_keys
+        fingerprint = config.fingerprint()
+        image_paths = [
+            image_path for image_path in image_paths
+            if not manifest.is_complete(image_path, fingerprint, config.num_samples_per_image)
+        ]
+    puzzle_index = None
+    if config.dedupe == "exact":
+        puzzle_index = PuzzleIndex(puzzle_keys)
+    elif config.dedupe == "bloom":
+        capacity = len(puzzle_keys) + len(image_paths) * config.num_samples_per_image
+        puzzle_index = BloomFilter(capacity, config.bloom_error_rate, puzzle_keys)
+    if config.prefetch > 0:
+        # Each task is a batch, so the worker knows which images to decode ahead.
+        worker = functools.partial(_generate_batch_task, config=config)
+        tasks = [image_paths[i:i + chunksize] for i in range(0, len(image_paths), chunksize)]
+        task_chunksize = 1
+    else:
+        worker = functools.partial(_generate_image_task, config=config)
+        tasks = image_paths
+        task_chunksize = chunksize
+    # Only the parent shows progress, so workers started with spawn never import tqdm.
+    from tqdm import tqdm
+    num_puzzles = 0
+    planner_stats = PlannerStats()
+    with (Pool(processes=workers, initializer=_init_worker, initargs=(config, part_prefix, completed, puzzle_index)) as pool,
+          tqdm(total=len(image_paths), unit="image") as progress):
+        for num_images, count, image_planner_stats, profile in pool.imap_unordered(
+                worker, tasks, chunksize=task_chunksize):
+            progress.update(num_images)
+            num_puzzles += count
+            planner_stats.merge(image_planner_stats)
+            if profile is not None and profiles is not None:
+                pid = profile["pid"]
+                profiles[pid] = instrumentation.merge([profiles[pid], profile]) if pid in profiles else profile
+        # Let the workers exit normally so they close their open shards.
+        pool.close()
+        pool.join()
+    return num_puzzles, planner_stats
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate the visual puzzle dataset.")
+    parser.add_argument("--images", default="images", help="Folder with the source images.")
+    parser.add_argument("--output", default="dataset", help="Folder the puzzles are written to.")
+    parser.add_argument("--samples-per-image", type=int, default=5)
+    parser.add_argument("--graph-size", type=int, default=11)
+    parser.add_argument(
+        "--tiles-per-side", type=int, default=3,
+        help="Split every image into N x N blocks, e.g. 6 or 8 with a --graph-size of 32 or more."
+        )
+    parser.add_argument(
+        "--chunk-selection", choices=CHUNK_SELECTIONS, default=None,
+        help="How the blocks to move are drawn; defaults to uniform for 3x3 tilings and frontier otherwise."
+        )
+    parser.add_argument("--puzzle-complexity", type=int, default=2)
+    parser.add_argument(
+        "--puzzle-distance-thr", type=int, default=3,
+        help="Maximum Manhattan distance a block is displaced, 0 for no limit."
+        )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--max-tile-size", type=int, default=None,
+        help="Longest tile side in pixels; larger images are downscaled while decoding to bound memory."
+        )
+    parser.add_argument("--tile-cache-mb", type=float, default=None, help="Pixel data kept per worker cache.")
+    parser.add_argument(
+        "--tile-store", default=None,
+        help="Tile store built by tile_store.py; its images are not decoded by the workers."
+        )
+    parser.add_argument(
+        "--planner", choices=["prioritized", "legacy"], default="prioritized",
+        help="'prioritized' plans collision-free moves; 'legacy' interleaves independent shortest "
+             "paths that may run through other blocks, like the original dataset."
+        )
+    parser.add_argument("--planner-max-nodes", type=int, default=100_000, help="A* expansions per puzzle.")
+    parser.add_argument(
+        "--planner-time-budget", type=float, default=None,
+        help="Seconds per puzzle; running out aborts the run instead of redrawing, which would depend on the machine."
+        )
+    parser.add_argument("--max-attempts", type=int, default=100, help="Draws per puzzle before giving up.")
+    parser.add_argument(
+        "--dedupe", choices=["exact", "bloom", "off"], default="exact",
+        help="Redraw puzzles already generated for the same image, tracked in a set or a Bloom filter."
+        )
+    parser.add_argument("--bloom-error-rate", type=float, default=1e-4)
+    parser.add_argument(
+        "--io-threads", type=int, default=0,
+        help="Threads per worker that encode and write puzzle images in the background; 0 writes inline."
+        )
+    parser.add_argument("--max-pending-writes", type=int, default=16, help="Images queued before a worker waits.")
+    parser.add_argument(
+        "--prefetch", type=int, default=0,
+        help="Source images each worker decodes ahead on a background thread; 0 disables prefetching."
+        )
+    parser.add_argument("--workers", type=int, default=None, help="Defaults to the number of CPUs.")
+    parser.add_argument("--chunksize", type=int, default=4, help="Images handed to a worker at once.")
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--shard-index", type=int, default=0)
+    parser.add_argument(
+        "--output-format", choices=["folder", "tar", "tensors"], default="folder",
+        help="'folder' writes one PNG per puzzle; 'tar' packs puzzles and their records into "
+             "WebDataset tar shards listed in shards.json; 'tensors' renders nothing and stores "
+             "boards and solutions as memory-mappable .npy arrays, see tensor_export.py."
+        )
+    parser.add_argument(
+        "--encoder", default="png",
+        help="Puzzle image encoder: png, webp or bmp, with options such as 'png:compress_level=1' "
+             "or 'png:optimize=1'. See image_encoders.py."
+        )
+    parser.add_argument("--shard-max-mb", type=float, default=256, help="Size at which a tar shard is closed.")
+    parser.add_argument("--shard-max-samples", type=int, default=None, help="Puzzles per tar shard.")
+    parser.add_argument(
+        "--metadata-format", choices=["csv", "jsonl"], default="csv",
+        help="Format of the merged metadata file."
+        )
+    parser.add_argument(
+        "--animations", default=None,
+        help="Also write a solve animation for every puzzle into this folder."
+        )
+    parser.add_argument("--animation-format", choices=["gif", "apng"], default="gif")
+    parser.add_argument("--animation-frame-duration", type=int, default=700, help="In milliseconds.")
+    parser.add_argument(
+        "--no-merge", action="store_true",
+        help="Leave the metadata part files unmerged, e.g. to merge all shards later."
+        )
+    parser.add_argument(
+        "--no-resume", action="store_true",
+        help="Regenerate every puzzle, even those already listed in the output manifest."
+        )
+    parser.add_argument(
+        "--profile", default=None,
+        help="Write per stage timings and counters of every worker to this JSON file."
+        )
+    parser.add_argument(
+        "--trace", default=None,
+        help="Write every timed span to this file in the Chrome trace event format."
+        )
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> None:
+    args = parse_args(argv)
+    config = GenerationConfig(
+        output_folder=args.output,
+        num_samples_per_image=args.samples_per_image,
+        graph_size=args.graph_size,
+        tiles_per_side=args.tiles_per_side,
+        chunk_selection=args.chunk_selection,
+        puzzle_complexity=args.puzzle_complexity,
+        puzzle_distance_thr=args.puzzle_distance_thr or None,
+        seed=args.seed,
+        max_tile_size=args.max_tile_size,
+        tile_store=args.tile_store,
+        tile_cache_max_bytes=int(args.tile_cache_mb * 1024 * 1024) if args.tile_cache_mb else None,
+        output_format=args.output_format,
+        encoder=args.encoder,
+        shard_max_bytes=int(args.shard_max_mb * 1024 * 1024),
+        shard_max_samples=args.shard_max_samples,
+        animation_folder=args.animations,
+        animation_format=args.animation_format,
+        animation_frame_duration=args.animation_frame_duration,
+        planner=args.planner,
+        planner_max_nodes=args.planner_max_nodes,
+        planner_time_budget=args.planner_time_budget,
+        max_attempts=args.max_attempts,
+        dedupe=args.dedupe,
+        io_threads=args.io_threads,
+        max_pending_writes=args.max_pending_writes,
+        prefetch=args.prefetch,
+        bloom_error_rate=args.bloom_error_rate,
+        profile=args.profile is not None,
+        trace=args.trace is not None
+        )
+    image_paths = select_shard(list_source_images(args.images), args.num_shards, args.shard_index)
+    profiles = {}
+    num_puzzles, planner_stats = generate_dataset(
+        image_paths,
+        config,
+        workers=args.workers,
+        chunksize=args.chunksize,
+        part_prefix=f"metadata-{args.shard_index:05d}-of-{args.num_shards:05d}",
+        profiles=profiles,
+        resume=not args.no_resume
+        )
+    if not args.no_merge:
+        if args.output_format == "tensors":
+            merge_tensor_parts(args.output, config.graph_size)
+        else:
+            merge_metadata(args.output, args.metadata_format)
+        if args.output_format == "tar":
+            write_shard_index(args.output)
+    print(f"Generated {num_puzzles} puzzles from {len(image_paths)} images.")
+    if args.planner != "legacy":
+        print(f"Planner statistics: {planner_stats.as_dict()}")
+    if args.profile is not None:
+        instrumentation.write_json(args.profile, profiles)
+    if args.trace is not None:
+        instrumentation.write_chrome_trace(args.trace, profiles.values())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,106 @@
-from PIL import Image, ImageOps
+from PIL import Image, ImageDraw, ImageOps
+import numpy as np
 import typing
-from create_graph_dataset import Graph, PathFinder
+from create_graph_dataset import EMPTY, Graph, PathFinder
 import os
-from PIL import ImageDraw, ImageFont
-from PIL import Image, ImageDraw, ImageFont
-import pandas as pd
+from tile_cache import TileCache, TileSet
+from frame_renderer import FrameRenderer, load_font
+from sample_writer import FolderSampleWriter
+from image_encoders import ImageEncoder
+from multi_block_planner import PrioritizedPlanner
+from batch_compositor import BatchCompositor
+import instrumentation
 
 class ImageGraph:
-    def __init__(self, image_path: str, graph_size: int = 11):
+    def __init__(
+            self,
+            image_path: str,
+            graph_size: int = 11,
+            tile_cache: TileCache = None,
+            max_tile_size: int = None,
+            decode: bool = True,
+            tile_store=None,
+            tiles_per_side: int = 3
+            ):
+        """
+        Args:
+            max_tile_size: longest side of a tile in pixels. Larger source images are
+                downscaled while they are decoded, so memory does not grow with the source
+                resolution. None keeps the full resolution.
+            decode: when False, the image is not read at all and only the board is set up,
+                for render-free uses such as `shuffle_chunks`.
+            tile_store: a `tile_store.TileStore` to take the tiles from instead of decoding
+                the image. Images missing from the store are decoded as usual.
+            tiles_per_side: the image is split into tiles_per_side x tiles_per_side tiles,
+                placed in the center of the graph_size x graph_size board.
+        """
+        if not 0 < tiles_per_side <= graph_size:
+            raise ValueError(f"tiles_per_side must be between 1 and graph_size ({graph_size}), got {tiles_per_side}")
         self.image_path = image_path
         self.graph_size = graph_size
-        self.original_image = Image.open(image_path)
-        self.resized_image = self._resize_image_to_divisible_by_three(self.original_image)
-        self.chunk_size = self._calculate_chunk_size()
-        self.embedded_image = self._embed_image()
+        self.max_tile_size = max_tile_size
+        self.tiles_per_side = tiles_per_side
+        tile_set = None
+        if not decode:
+            tile_set = TileSet(None, None)
+        elif tile_store is not None:
+            tile_set = tile_store.get(image_path, max_tile_size, tiles_per_side)
+        if tile_set is None:
+            if tile_cache is not None:
+                # The tiles depend on the tiling and tile size, not only on the image.
+                tile_set = tile_cache.get(
+                    (image_path, tiles_per_side, max_tile_size),
+                    lambda _: self._load_tile_set(image_path)
+                    )
+            else:
+                tile_set = self._load_tile_set(image_path)
+        self.chunk_size = tile_set.chunk_size
+        self.tiles = tile_set.tiles
+        self.tile_array = tile_set.tile_array
+        self._embedded_image = None
+        self._batch_compositor = None
         self.graph = self._create_graph()
         # print(self.graph)
         # print(self.graph.chunks[0].x)
 
-    def _calculate_chunk_size(self) -> typing.Tuple[int, int]:
-        """Calculate the size of each chunk based on the original image."""
-        resized_image = self._resize_image_to_divisible_by_three(self.original_image)
-        return (resized_image.width // 3, resized_image.height // 3)
+    def _load_tile_set(self, image_path: str) -> TileSet:
+        """Decode and pad the source image once and split it into its tiles."""
+        with instrumentation.span("decode"):
+            original_image = Image.open(image_path)
+            if self.max_tile_size is not None:
+                # JPEGs are decoded at a reduced scale (draft mode) and other formats are
+                # reduced on load, so the full resolution image is never held in memory.
+                limit = self.tiles_per_side * self.max_tile_size
+                original_image.thumbnail((limit, limit), Image.BICUBIC, reducing_gap=2.0)
+            original_image.load()
+        instrumentation.count("images_decoded")
+        with instrumentation.span("pad"):
+            resized_image = self._resize_image_to_divisible_by_tiles(original_image)
+        chunk_size = (resized_image.width // self.tiles_per_side, resized_image.height // self.tiles_per_side)
+        with instrumentation.span("split"):
+            tiles = self._split_image(resized_image, chunk_size)
+        return TileSet(chunk_size, tiles)
+
+    def reset(self) -> None:
+        """Move every chunk back to its original position, reusing the decoded tiles."""
+        self.graph = self._create_graph()
 
-    def _resize_image_to_divisible_by_three(self, image: Image.Image) -> Image.Image:
-        """Resize the image to make its dimensions divisible by 3."""
+    def _resize_image_to_divisible_by_tiles(self, image: Image.Image) -> Image.Image:
+        """Resize the image to make its dimensions divisible by `tiles_per_side`."""
         width, height = image.size
-        print(f"Image dimension {width}*{height}")
-        new_width = width + (-width % 3)
-        new_height = height + (-height % 3)
+        new_width = width + (-width % self.tiles_per_side)
+        new_height = height + (-height % self.tiles_per_side)
         resized_image = ImageOps.pad(image, (new_width, new_height), method=Image.BICUBIC, color='black')
         return resized_image
 
-    def _split_image(self, image: Image.Image) -> typing.List[Image.Image]:
-        """Split the image into 9 equal-sized chunks."""
+    def _split_image(
+            self,
+            image: Image.Image,
+            chunk_size: typing.Tuple[int, int] = None
+            ) -> typing.List[Image.Image]:
+        """Split the image into `tiles_per_side` x `tiles_per_side` equal-sized chunks."""
         width, height = image.size
-        chunk_width, chunk_height = self.chunk_size
+        chunk_width, chunk_height = chunk_size if chunk_size is not None else self.chunk_size
 
         chunks = []
         for i in range(0, width, chunk_width):
@@ -45,31 +110,37 @@ class ImageGraph:
 
         return chunks
 
+    @property
+    def embedded_image(self) -> Image.Image:
+        """The source image in the center of the empty board, built on first use."""
+        if self._embedded_image is None:
+            self._embedded_image = self._embed_image()
+        return self._embedded_image
+
     def _embed_image(self) -> Image.Image:
         """Embed the original image into the center of a larger image."""
         new_image_size = (self.graph_size * self.chunk_size[0], self.graph_size * self.chunk_size[1])
         new_image = Image.new('RGB', new_image_size)
 
-        chunks = self._split_image(self._resize_image_to_divisible_by_three(self.original_image))
-        start_x = (self.graph_size - 3) // 2 * self.chunk_size[0]
-        start_y = (self.graph_size - 3) // 2 * self.chunk_size[1]
-
-        for i in range(3):
-            for j in range(3):
-                box = (start_x + i * self.chunk_size[0], start_y + j * self.chunk_size[1])
-                new_image.paste(chunks[i * 3 + j], box)
+        chunks = self.tiles
+        for chunk_index, (x, y) in enumerate(self._home_positions()):
+            new_image.paste(chunks[chunk_index], (x * self.chunk_size[0], y * self.chunk_size[1]))
 
         return new_image
 
     def _create_graph(self) -> Graph:
         """Create a graph based on the embedded image, positioning the chunks correctly."""
-        # Calculate the starting positions for the chunks in the 11x11 grid
-        start_x = (self.graph_size - 3) // 2
-        start_y = (self.graph_size - 3) // 2
-
-        # Create chunk positions based on the starting coordinates
-        chunk_positions = [(start_x + x, start_y + y) for x in range(3) for y in range(3)]
-        return Graph(self.graph_size, self.graph_size, chunk_positions)
+        return Graph(self.graph_size, self.graph_size, self._home_positions())
+
+    def _home_positions(self) -> typing.List[typing.Tuple[int, int]]:
+        """The solved cell of every chunk, in chunk (and tile) order."""
+        # The tiles form a square in the center of the board, listed column by column.
+        start = (self.graph_size - self.tiles_per_side) // 2
+        return [
+            (start + x, start + y)
+            for x in range(self.tiles_per_side)
+            for y in range(self.tiles_per_side)
+        ]
 
     def show_embedded_image(self):
         """Display the embedded image."""
@@ -102,89 +173,139 @@ class ImageGraph:
         instructions_per_chunk = {}
 
         path_finder = PathFinder(self.graph)
-        path_finder.find_paths()
 
         for chunk in chunks_to_move_list:
             start_coord = chunk.x, chunk.y
             end_coord = end_coords_dict[chunk]
 
-            if end_coord not in path_finder.paths[start_coord]:
+            instructions = path_finder.find_path(start_coord, end_coord)
+            if instructions is None:
                 raise ValueError(f"No path found to move chunk {start_coord} to {end_coord}")
-            
-            instructions = path_finder.paths[start_coord][end_coord]
             instructions_per_chunk[chunk] = instructions
         return instructions_per_chunk
     
+    def plan_moves(self, chunks_to_move_list: list, end_coords_dict: dict, planner: PrioritizedPlanner = None) -> list:
+        """Returns a collision-free, ordered list of (chunk, direction) moves that bring the
+        chunks to their end coordinates. Raises `PlanningError` when the planner gives up.
+
+        Args:
+            chunks_to_move_list (list): chunks to displace.
+            end_coords_dict (dict): chunk -> end coordinate.
+            planner (PrioritizedPlanner): planner to use, a default one when None.
+        """
+        if planner is None:
+            planner = PrioritizedPlanner()
+        goals = {chunk: end_coords_dict[chunk] for chunk in chunks_to_move_list}
+        return planner.plan(self.graph, goals)
+
     def generate_data_point(
             self,
-            chunk_instructions: dict, 
+            chunk_instructions, 
             output_folder: str,
             image_name: str, 
             chunk_block_map: dict,
-            metadata: list[dict]
+            metadata: list[dict],
+            sample_writer: FolderSampleWriter = None,
+            manifest_entry: dict = None,
+            encoder: ImageEncoder = None
             ) -> dict:
-        instructions = []
-        debug_instruction = {}
-        step_count = 0
-        max_steps = 0
-        for chunk in chunk_instructions:
-            max_steps = max(len(chunk_instructions[chunk]), max_steps)
-            debug_instruction[chunk] = []
-
-
-        for steps in range(max_steps):
-            for chunk in chunk_instructions:
-                try:
-                    block_tag = chunk_block_map[chunk]
-                    operation = chunk_instructions[chunk][steps]
-                    self._move_chunk(chunk, operation)
-                    operation = self.invert_operation(operation)
-                    debug_instruction[chunk].append(operation)
-                    operation = f"Move block {block_tag} {operation}"
-                    instructions.append(operation)
-                    # print(instructions)
-                    step_count += 1
-                except:
-                    pass
-    
-        instructions.reverse()
-        shuffledd_chunk_block_map = {}
-        for chunk in chunk_instructions:
-            shuffledd_chunk_block_map[chunk] = chunk_block_map[chunk]
-            debug_instruction[chunk].reverse()
+        """Shuffle the chunks along their paths, save the puzzle image and record its metadata.
+
+        `chunk_instructions` is either the dict of paths per chunk from `get_paths_per_chunks`,
+        whose moves are interleaved round-robin, or an ordered move list from `plan_moves`.
+        `metadata` only needs an `append` method: a plain list or a `MetadataWriter`.
+        The image and its record go to `sample_writer` when given (e.g. a `TarShardWriter`),
+        otherwise to `<output_folder>/<image_name>.png` (or the extension of `encoder`) and
+        `metadata`. `manifest_entry` is handed to the sample writer, which records it once
+        the image is written.
+        """
+        shuffle = self.shuffle_chunks(chunk_instructions, chunk_block_map)
+        instructions = shuffle["instructions"]
+        debug_instruction = shuffle["debug_instructions"]
+        solution_moves = shuffle["moves"]
+        goal_positions = shuffle["goals"]
         img = self._generate_updated_image_with_instructions(
             instructions, 
-            shuffledd_chunk_block_map,
+            shuffle["shuffled_chunk_block_map"],
             instruction_mode=False
             )
-        metadata.append({
-            "file_name": f"{image_name}.png",
-            "instructions": self.convert_list_of_strings_to_string(instructions)
-        })
-        img.save(os.path.join(output_folder, f"{image_name}.png"))
-        metadata_df = pd.DataFrame(metadata)
-        metadata_df.to_csv(f"{output_folder}/metadata.csv", index=False)
+        if sample_writer is None:
+            sample_writer = FolderSampleWriter(output_folder, metadata, encoder=encoder)
+        record = {
+            "file_name": f"{image_name}.{sample_writer.extension}",
+            "instructions": self.convert_list_of_strings_to_string(instructions),
+            "graph_size": self.graph_size,
+            "blocks": self.get_block_positions(chunk_block_map),
+            "goals": goal_positions
+        }
+        sample_writer.write_sample(image_name, img, record, manifest_entry)
+        instrumentation.count("puzzles_emitted")
 
         # debuggin data structrures
         data_point_for_visualization = {}
         data_point_for_visualization["instructions"] = debug_instruction
+        data_point_for_visualization["moves"] = solution_moves
         data_point_for_visualization["graph"] = self.graph
         data_point_for_visualization["start_image"] = img
         return data_point_for_visualization
     
 
+    def shuffle_chunks(self, chunk_instructions, chunk_block_map: dict) -> dict:
+        """Apply the moves to the board and derive the solution, without rendering anything.
+
+        Returns a dict with the solution `instructions` (strings) and `moves` ((chunk,
+        direction) pairs), the `goals` of every block, the solution directions per chunk in
+        `debug_instructions` and the `shuffled_chunk_block_map` of the moved chunks.
+        """
+        instructions = []
+        debug_instruction = {}
+        if isinstance(chunk_instructions, dict):
+            debug_instruction = {chunk: [] for chunk in chunk_instructions}
+        solution_moves = []
+        goal_positions = self.get_block_positions(chunk_block_map)
+        for chunk, operation in self._as_move_sequence(chunk_instructions):
+            if chunk not in debug_instruction:
+                debug_instruction[chunk] = []
+            block_tag = chunk_block_map[chunk]
+            self._move_chunk(chunk, operation)
+            operation = self.invert_operation(operation)
+            debug_instruction[chunk].append(operation)
+            solution_moves.append((chunk, operation))
+            instructions.append(f"Move block {block_tag} {operation}")
+
+        instructions.reverse()
+        solution_moves.reverse()
+        shuffled_chunk_block_map = {}
+        for chunk in debug_instruction:
+            shuffled_chunk_block_map[chunk] = chunk_block_map[chunk]
+            debug_instruction[chunk].reverse()
+        return {
+            "instructions": instructions,
+            "moves": solution_moves,
+            "goals": goal_positions,
+            "debug_instructions": debug_instruction,
+            "shuffled_chunk_block_map": shuffled_chunk_block_map
+        }
+
     def generate_images_for_demo(
             self, 
             chunk_instructions,
             output_folder,
             chunk_block_map,
-            start_image
+            start_image,
+            encoder: ImageEncoder = None
             ):
-        start_image.save(os.path.join(output_folder, f"a_{-2}.png"))
-        self.move_chunks(chunk_instructions, output_folder, chunk_block_map)
+        self._save_image(start_image, output_folder, f"a_{-2}", encoder)
+        self.move_chunks(chunk_instructions, output_folder, chunk_block_map, encoder)
 
 
-    def move_chunks(self, chunk_instructions: dict, output_folder: str, chunk_block_map: dict) -> None:
+    def move_chunks(
+            self,
+            chunk_instructions,
+            output_folder: str,
+            chunk_block_map: dict,
+            encoder: ImageEncoder = None
+            ) -> None:
         """This method is to save state of the image after every operation: helps in visualizing
         the path.
 
@@ -192,29 +313,56 @@ class ImageGraph:
             chunk_instructions (list): _description_
             output_folder (str): _description_
             chunk_block_map (dict): _description_
+            encoder (ImageEncoder): format of the frames, PNG when None.
         """
-        instructions = []
-        step_count = 0
-        img = self._generate_updated_image_with_instructions(instructions)
-        img.save(os.path.join(output_folder, f"a_{-1}.png"))
+        frames = self.iter_move_frames(chunk_instructions, chunk_block_map, copy_frames=False)
+        for step_count, img in enumerate(frames, start=-1):
+            if step_count == -1:
+                self._save_image(img, output_folder, f"a_{-1}", encoder)
+            else:
+                self._save_image(img, output_folder, f"step_{step_count}", encoder)
+
+    @staticmethod
+    def _save_image(img: Image.Image, output_folder: str, name: str, encoder: ImageEncoder = None) -> None:
+        if encoder is None:
+            encoder = ImageEncoder()
+        encoder.save(img, os.path.join(output_folder, f"{name}.{encoder.extension}"))
+
+    def iter_move_frames(
+            self,
+            chunk_instructions,
+            chunk_block_map: dict,
+            copy_frames: bool = True
+            ) -> typing.Iterator[Image.Image]:
+        """Yield the frame before the first move and the frame after every move.
+
+        `chunk_instructions` is a dict of paths per chunk, applied round-robin like in
+        `generate_data_point`, or an ordered list of (chunk, direction) moves. Frames are
+        rendered incrementally by a `FrameRenderer`.
+        """
+        moves = (
+            (chunk, operation, f"Move block {chunk_block_map[chunk]} {operation}")
+            for chunk, operation in self._as_move_sequence(chunk_instructions)
+        )
+        return FrameRenderer(self).frames(moves, copy_frames=copy_frames)
+
+    @classmethod
+    def _as_move_sequence(cls, chunk_instructions) -> typing.Iterator[tuple]:
+        if isinstance(chunk_instructions, dict):
+            return cls._interleave_chunk_instructions(chunk_instructions)
+        return iter(chunk_instructions)
+
+    @staticmethod
+    def _interleave_chunk_instructions(chunk_instructions: dict) -> typing.Iterator[tuple]:
+        """Yield `(chunk, operation)` pairs taking one step of every chunk in turn."""
         max_steps = 0
         for chunk in chunk_instructions:
             max_steps = max(len(chunk_instructions[chunk]), max_steps)
 
         for steps in range(max_steps):
             for chunk in chunk_instructions:
-                try:
-                    block_tag = chunk_block_map[chunk]
-                    operation = chunk_instructions[chunk][steps]
-                    self._move_chunk(chunk, operation)
-                    operation = f"Move block {block_tag} {operation}"
-                    instructions.append(operation)
-                    # print(instructions)
-                    img = self._generate_updated_image_with_instructions(instructions)
-                    img.save(os.path.join(output_folder, f"step_{step_count}.png"))
-                    step_count += 1
-                except:
-                    pass
+                if steps < len(chunk_instructions[chunk]):
+                    yield chunk, chunk_instructions[chunk][steps]
 
     def _generate_updated_image_with_instructions(
             self, 
@@ -222,72 +370,112 @@ class ImageGraph:
             shuffled_chunk_map: dict=None,
             instruction_mode: bool = True
             ) -> Image.Image:
-        """Generate an image with the current state and a panel of instructions."""
+        """Generate an image with the current state and a panel of instructions.
+
+        Without `instruction_mode` the board alone is returned and no panel is drawn.
+        """
         updated_image = self._generate_updated_image(shuffled_chunk_map)
+        if instruction_mode is not True:
+            return updated_image
         instruction_image = Image.new('RGB', (200, updated_image.height), color='white')
         draw = ImageDraw.Draw(instruction_image)
-        font = ImageFont.load_default()  # You can use a custom font here
-
-        font_size = 20  # You can adjust the size
-        font = ImageFont.load_default()
-        try:
-            font = ImageFont.truetype("arial", font_size)
-        except IOError:
-            print("Default font not found. Using PIL's load_default() font.")
+        font = load_font(20)  # Cached per process, falls back to PIL's default font
 
         # Add instructions to the instruction panel
         y_position = 10
-        for instruction in instructions:
-            draw.text((10, y_position), instruction, fill='black', font=font)
-            y_position += 20
-        if instruction_mode is True:
-            # Concatenate instruction panel and updated image
-            combined_image = Image.new('RGB', (instruction_image.width + updated_image.width, updated_image.height))
-            combined_image.paste(instruction_image, (0, 0))
-            combined_image.paste(updated_image, (instruction_image.width, 0))
-            return combined_image
-        return updated_image
+        with instrumentation.span("draw_instructions"):
+            for instruction in instructions:
+                draw.text((10, y_position), instruction, fill='black', font=font)
+                y_position += 20
+        # Concatenate instruction panel and updated image
+        combined_image = Image.new('RGB', (instruction_image.width + updated_image.width, updated_image.height))
+        combined_image.paste(instruction_image, (0, 0))
+        combined_image.paste(updated_image, (instruction_image.width, 0))
+        return combined_image
 
     def _move_chunk(self, chunk, direction):
         """Move a chunk in a specified direction."""
-        connections_vector = {
-            'left': (-1, 0),
-            'right': (1, 0),
-            'up': (0, -1),
-            'down': (0, 1)
-        }
-        direction_vector = connections_vector[direction]
-        chunk.x, chunk.y = chunk.x + direction_vector[0], chunk.y + direction_vector[1]
+        self.graph.move_chunk(chunk, direction)
 
     def _generate_updated_image(self, shuffled_chunk_map: dict=None) -> Image.Image:
         """Generate an image reflecting the current state of the graph.
         
         if shuffled chunk is not none, then we annotate the shuffle chunks below them as blocks.
         """
+        with instrumentation.span("composite"):
+            return self._compose_updated_image(shuffled_chunk_map)
+
+    def _compose_updated_image(self, shuffled_chunk_map: dict=None) -> Image.Image:
+        """Start from the solved board and repaint only the cells moved blocks left or entered.
+
+        The result is the same as pasting every tile in chunk order, each followed by its
+        label: a label is covered by the tiles of higher index it overlaps, so those are
+        pasted again after it. The work grows with the number of moved blocks, not with the
+        number of tiles.
+        """
         border = 38
+        chunk_width, chunk_height = self.chunk_size
         new_image = Image.new(
             'RGB', 
-            (self.graph_size * self.chunk_size[0], (self.graph_size * self.chunk_size[1]) + border)
+            (self.graph_size * chunk_width, (self.graph_size * chunk_height) + border)
             )
-        chunks = self._split_image(self.resized_image)  # Use the resized image
-        font = ImageFont.truetype("arial.ttf", 18)  # Load a font, with size appropriate for your chunks
+        new_image.paste(self.embedded_image, (0, 0))
+        dirty_cells = set()
+        for chunk, home in zip(self.graph.chunks, self._home_positions()):
+            if (chunk.x, chunk.y) != home:
+                dirty_cells.add(home)
+                dirty_cells.add((chunk.x, chunk.y))
+        for cell in dirty_cells:
+            self._paint_cell(new_image, cell)
+        if not shuffled_chunk_map:
+            return new_image
+        font = load_font(18)  # Load a font, with size appropriate for your chunks
         draw = ImageDraw.Draw(new_image)  # Create a drawing context
-        chunk_index = 0
         for chunk in self.graph.chunks:
-            # print(chunk.x, chunk.y, chunk_index)
-            chunk_image = chunks[chunk_index]
-            box = (chunk.x * self.chunk_size[0], chunk.y * self.chunk_size[1])
-            new_image.paste(chunk_image, box)
-            if shuffled_chunk_map is not None:
-                if chunk not in shuffled_chunk_map.keys(): pass
-                else:
-                    block_tag = shuffled_chunk_map[chunk]
-                    # Calculate position to place the text based on the chunk's position
-                    text_position = (box[0], box[1] + self.chunk_size[1] + 10)  # Adjust as needed
-                    draw.text(text_position, f"Block {block_tag}", fill='white', font=font)
-            chunk_index = chunk_index + 1
+            if chunk not in shuffled_chunk_map:
+                continue
+            text = f"Block {shuffled_chunk_map[chunk]}"
+            # Below the chunk's cell
+            text_position = (chunk.x * chunk_width, (chunk.y + 1) * chunk_height + 10)
+            draw.text(text_position, text, fill='white', font=font)
+            left, top, right, bottom = draw.textbbox(text_position, text, font=font)
+            for x in range(max(left // chunk_width, 0), min((right - 1) // chunk_width, self.graph_size - 1) + 1):
+                for y in range(max(top // chunk_height, 0), min((bottom - 1) // chunk_height, self.graph_size - 1) + 1):
+                    if self.graph.block_ids[x, y] > chunk.index:
+                        self._paint_cell(new_image, (x, y))
         return new_image
-    
+
+    def _paint_cell(self, image: Image.Image, cell: typing.Tuple[int, int]) -> None:
+        """Paste the visible tile of `cell`, or black if it is empty."""
+        chunk_width, chunk_height = self.chunk_size
+        box = (cell[0] * chunk_width, cell[1] * chunk_height)
+        block_id = self.graph.block_ids[cell]
+        if block_id == EMPTY:
+            image.paste((0, 0, 0), box + (box[0] + chunk_width, box[1] + chunk_height))
+        else:
+            image.paste(self.tiles[block_id], box)
+
+    def compose_batch(self, positions: np.ndarray, labels: typing.List[dict] = None) -> np.ndarray:
+        """Compose the boards of many puzzles of this image at once, as a uint8 array.
+
+        `positions` is a `(batch, 9, 2)` array of tile cells, e.g. stacked `graph.positions()`
+        or the `starts` of a tensor export, and `labels` maps tile indices to block tags per
+        board. Returns `(batch, height, width, 3)` pixels equal to `_generate_updated_image`,
+        in a buffer that is reused by the next call.
+        """
+        if self._batch_compositor is None:
+            self._batch_compositor = BatchCompositor(
+                self.tiles,
+                self.chunk_size,
+                self.graph_size,
+                tile_array=self.tile_array
+                )
+        return self._batch_compositor.compose(positions, labels)
+
+    def get_block_positions(self, chunk_block_map: dict) -> dict:
+        """Map every block tag to the current [x, y] cell of its chunk."""
+        return {chunk_block_map[chunk]: [chunk.x, chunk.y] for chunk in self.graph.chunks}
+
     @staticmethod
     def convert_list_of_strings_to_string(instruction_list: list[str]) -> str:
         instruction_str = ""
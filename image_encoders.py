@@ -0,0 +1,88 @@
+"""Image encoders for puzzle images and demo frames.
+
+An encoder turns a rendered `PIL.Image` into file bytes with one format and fixed options.
+Encoders are selected by a spec string, the format name optionally followed by options:
+
+    png                          PIL's default PNG (zlib level 6)
+    png:compress_level=1         faster, larger PNG
+    png:optimize=1               slowest, smallest PNG
+    webp                         lossless WebP
+    webp:method=6                lossless WebP, more effort
+    bmp                          uncompressed, for intermediate frames
+
+Example:
+    encoder = get_encoder("png:compress_level=1")
+    encoder.save(image, f"puzzle.{encoder.extension}")
+"""
+import io
+
+from PIL import Image
+
+import instrumentation
+
+# Format name -> (PIL format, file extension, default save options).
+ENCODER_FORMATS = {
+    "png": ("PNG", "png", {}),
+    "webp": ("WEBP", "webp", {"lossless": True, "method": 4}),
+    "bmp": ("BMP", "bmp", {}),
+}
+
+
+class ImageEncoder:
+    """Encode images to `image_format` with the PIL save `options`."""
+
+    def __init__(self, image_format: str = "png", **options) -> None:
+        if image_format not in ENCODER_FORMATS:
+            raise ValueError(f"Unknown image format {image_format!r}, expected one of {sorted(ENCODER_FORMATS)}")
+        pil_format, extension, defaults = ENCODER_FORMATS[image_format]
+        self.image_format = image_format
+        self.pil_format = pil_format
+        self.extension = extension
+        self.options = {**defaults, **options}
+
+    @property
+    def spec(self) -> str:
+        """The spec string that `get_encoder` turns back into this encoder."""
+        options = ",".join(f"{key}={value}" for key, value in sorted(self.options.items()))
+        return f"{self.image_format}:{options}" if options else self.image_format
+
+    def encode(self, image: Image.Image) -> bytes:
+        with instrumentation.span(f"{self.image_format}_encode"):
+            buffer = io.BytesIO()
+            image.save(buffer, format=self.pil_format, **self.options)
+        return buffer.getvalue()
+
+    def save(self, image: Image.Image, path: str) -> None:
+        data = self.encode(image)
+        with instrumentation.span("write"):
+            with open(path, "wb") as f:
+                f.write(data)
+        instrumentation.count("bytes_written", len(data))
+
+    def __repr__(self) -> str:
+        return f"ImageEncoder({self.spec!r})"
+
+
+def get_encoder(spec: str = "png") -> ImageEncoder:
+    """Build the encoder described by `spec`, e.g. "png:compress_level=1,optimize=1"."""
+    if isinstance(spec, ImageEncoder):
+        return spec
+    image_format, _, option_string = spec.partition(":")
+    options = {}
+    for option in filter(None, option_string.split(",")):
+        key, _, value = option.partition("=")
+        options[key.strip()] = _parse_option_value(value.strip())
+    return ImageEncoder(image_format.strip().lower(), **options)
+
+
+def _parse_option_value(value: str):
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
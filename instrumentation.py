@@ -0,0 +1,174 @@
+"""Opt-in timing spans and counters for the generation pipeline.
+
+Instrumentation is off by default: `span` then returns a shared no-op context manager and
+`count` returns after a single flag check, so the calls can stay in hot paths. After
+`enable()`, spans aggregate their count and total / max duration per name, counters sum
+their values, and with `trace=True` every span is also kept as a Chrome trace event.
+
+Each process records into its own module state, shared by its threads (the prefetch and
+writer threads of `io_pipeline` included) under one lock. Worker processes hand `collect()` results
+to the parent, which combines them with `merge` and writes them with `write_json` or
+`write_chrome_trace` (open the latter in chrome://tracing or Perfetto).
+
+Example:
+    instrumentation.enable()
+    with instrumentation.span("decode"):
+        image = Image.open(path)
+    instrumentation.count("images_decoded")
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+_enabled = False
+_trace = False
+_max_events = 100_000
+_counters = {}
+_spans = {}
+_events = []
+_lock = threading.Lock()
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def _reset_lock() -> None:
+    # A fork may copy the lock while another thread of the parent holds it.
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_lock)
+
+
+def enable(trace: bool = False, max_events: int = 100_000) -> None:
+    """Start recording; with `trace`, keep up to `max_events` span events per process."""
+    global _enabled, _trace, _max_events
+    _enabled = True
+    _trace = trace
+    _max_events = max_events
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    with _lock:
+        _reset()
+
+
+def _reset() -> None:
+    _counters.clear()
+    _spans.clear()
+    _events.clear()
+
+
+def count(name: str, value: int = 1) -> None:
+    """Add `value` to the counter `name`."""
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def span(name: str):
+    """Context manager timing the enclosed block under `name`."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+class _Span:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        elapsed = time.perf_counter() - self.started
+        with _lock:
+            stats = _spans.get(self.name)
+            if stats is None:
+                stats = _spans[self.name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            if _trace and len(_events) < _max_events:
+                _events.append({
+                    "name": self.name,
+                    "ph": "X",
+                    "ts": self.started * 1e6,
+                    "dur": elapsed * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident()
+                })
+
+
+def snapshot() -> dict:
+    """Return what this process recorded so far."""
+    with _lock:
+        return _snapshot()
+
+
+def _snapshot() -> dict:
+    return {
+        "pid": os.getpid(),
+        "counters": dict(_counters),
+        "spans": {
+            name: {"count": stats[0], "total_ms": stats[1] * 1000, "max_ms": stats[2] * 1000}
+            for name, stats in _spans.items()
+        },
+        "events": list(_events)
+    }
+
+
+def collect() -> dict:
+    """Return the snapshot of this process and start over, for incremental hand-offs."""
+    # Under one lock, so nothing recorded in between is lost.
+    with _lock:
+        data = _snapshot()
+        _reset()
+    return data
+
+
+def merge(snapshots) -> dict:
+    """Sum counters and spans of several snapshots and concatenate their events."""
+    merged = {"counters": {}, "spans": {}, "events": []}
+    for data in snapshots:
+        for name, value in data["counters"].items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + value
+        for name, stats in data["spans"].items():
+            total = merged["spans"].setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            total["count"] += stats["count"]
+            total["total_ms"] += stats["total_ms"]
+            total["max_ms"] = max(total["max_ms"], stats["max_ms"])
+        merged["events"].extend(data["events"])
+    return merged
+
+
+def write_json(path: str, per_worker: dict) -> None:
+    """Write per worker snapshots (keyed by pid) and their total, without trace events."""
+    def strip(data):
+        return {key: value for key, value in data.items() if key != "events"}
+    report = {
+        "total": strip(merge(per_worker.values())),
+        "workers": {str(pid): strip(data) for pid, data in per_worker.items()}
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def write_chrome_trace(path: str, snapshots) -> None:
+    """Write the span events of `snapshots` in the Chrome trace event format."""
+    merged = merge(snapshots)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": merged["events"], "displayTimeUnit": "ms"}, f)
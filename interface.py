@@ -1,12 +1,22 @@
-import os
-from PIL import Image
+"""Demo animations of a puzzle being solved.
+
+Nothing runs on import. `main` either draws a puzzle from one source image and streams
+its solution into an animation, or stitches frames saved earlier by
+`ImageGraph.generate_images_for_demo` (`--frames`).
+
+Example:
+    python interface.py --image images/dog.jpg --output demo_solving_puzzle.gif
+    python interface.py --frames output_images --output demo_solving_puzzle.gif
+"""
+import argparse
 import glob
-from graph_embedding import ImageGraph
-from puzzle_sampler import PuzzleSampler
-from create_graph_dataset import Graph, PathFinder
-import re
 import random
+import re
+
+from PIL import Image
 
+from animation import ANIMATION_FORMATS, write_animation
+from image_encoders import ENCODER_FORMATS
 
 
 def sort_key_func(file_path):
@@ -17,78 +27,101 @@ def sort_key_func(file_path):
     return int(numbers[0]) if numbers else 0
 
 def create_animated_gif(image_folder: str, output_gif: str, frame_duration: int = 500, new_size: tuple = None):
-    frames = []
-    images = sorted(glob.glob(f"{image_folder}/*.png"), key=sort_key_func)
-    for image_file in images:
-        print(image_file)
-        frame = Image.open(image_file)
-        # if new_size:
-        #     frame = frame.resize(new_size, Image.Resampling.LANCZOS)  # Updated resizing method
-        frames.append(frame)
-
-    frames[0].save(output_gif, format='GIF', append_images=frames[1:], save_all=True, duration=frame_duration, loop=0)
-
-
-
-# num_samples_per_image = 5
-# metadata = []
-# directory_path = 'images'
-
-# for filename in os.listdir(directory_path):
-#     # Construct full file path
-#     file_path = os.path.join(directory_path, filename)
-#     print(file_path)
-#     for i in range(num_samples_per_image):
-#         image_graph = ImageGraph(file_path)
-#         graph = image_graph.graph
-
-#         puzzle_sampler = PuzzleSampler()
-#         sampled_chunks_for_displacement = puzzle_sampler.sample_chunks_for_shuffle(graph)
-#         # print(sampled_chunks_for_displacement[0].x, sampled_chunks_for_displacement[0].y)
-
-#         chunk_block_map = puzzle_sampler.map_chunks_to_block_names(graph)
-
-#         non_chunk_indices_pairs = puzzle_sampler.get_non_chunk_indices(graph)
-#         # print(non_chunk_indices_pairs)
-
-#         end_coords_combos = puzzle_sampler.create_combination_end_indices(non_chunk_indices_pairs)
-#         # print(end_coords_combos[0], len(end_coords_combos))
-#         random.shuffle(end_coords_combos)
-
-#         chunk_to_end_coord_map = puzzle_sampler.map_chunks_to_indices(
-#             sampled_chunks_for_displacement,
-#             # [(10, 0), (0,10)]
-#             end_coords_combos[i]
-#             )
-#         # print(chunk_to_end_coord_map)
-
-#         instructions_per_chunk = image_graph.get_paths_per_chunks(sampled_chunks_for_displacement, chunk_to_end_coord_map)
-#         print(instructions_per_chunk)
-
-#         # image_graph.move_chunks(instructions_per_chunk, "output_images", chunk_block_map)
-#         image_name = f"{filename.split('.')[0]}_{i}"
-#         data_point = image_graph.generate_data_point(
-#             instructions_per_chunk, 
-#             "dataset",
-#             image_name,
-#             chunk_block_map,
-#             metadata
-#             )
-#         image_graph.generate_images_for_demo(
-#             chunk_instructions= data_point["instructions"],
-#             output_folder="output_images",
-#             chunk_block_map=chunk_block_map,
-#             start_image=data_point["start_image"]
-#         )
-#         break
-#     break
-        
-    
-
-# print(dataset)
-# new_width = 350  # Adjust the width as needed
-# new_height = 350  # Adjust the height as needed
-create_animated_gif('output_images', 'demo_solving_puzzle.gif',
-                    frame_duration=700, 
-                    # new_size=(new_width, new_height)
-                    )
+    """Stream the frames of `image_folder` into an animation, one frame in memory at a time.
+
+    Frames may be saved in any format of `image_encoders.ENCODER_FORMATS`. Prefer
+    `animation.render_solve_animation`, which skips the file round trip entirely.
+    """
+    extensions = tuple(f".{extension}" for _, extension, _ in ENCODER_FORMATS.values())
+    images = sorted(
+        (path for path in glob.glob(f"{image_folder}/*") if path.lower().endswith(extensions)),
+        key=sort_key_func
+        )
+
+    def frames():
+        for image_file in images:
+            print(image_file)
+            with Image.open(image_file) as frame:
+                # if new_size:
+                #     frame = frame.resize(new_size, Image.Resampling.LANCZOS)  # Updated resizing method
+                yield frame
+
+    write_animation(frames(), output_gif, animation_format="gif", duration=frame_duration, loop=0)
+
+
+def render_demo(
+        image_path: str,
+        output_path: str,
+        puzzle_complexity: int = 2,
+        seed: int = 0,
+        animation_format: str = "gif",
+        frame_duration: int = 700
+        ) -> int:
+    """Draw one puzzle from `image_path` and animate its solution; returns the frame count."""
+    # The generation modules are only needed here, not to stitch saved frames.
+    from animation import render_solve_animation
+    from generate_dataset import GenerationConfig, sample_puzzle
+    from graph_embedding import ImageGraph
+    from multi_block_planner import PrioritizedPlanner
+    from puzzle_sampler import PuzzleSampler
+
+    rng = random.Random(seed)
+    config = GenerationConfig(puzzle_complexity=puzzle_complexity, seed=seed)
+    image_graph = ImageGraph(image_path, graph_size=config.graph_size)
+    puzzle_sampler = PuzzleSampler(
+        graph_size=config.graph_size,
+        puzzle_complexity=puzzle_complexity,
+        puzzle_distance_thr=config.puzzle_distance_thr,
+        rng=rng
+        )
+    chunk_block_map, chunk_instructions, _ = sample_puzzle(
+        image_graph, config, puzzle_sampler, PrioritizedPlanner(rng=rng)
+        )
+    shuffle = image_graph.shuffle_chunks(chunk_instructions, chunk_block_map)
+    start_image = image_graph._generate_updated_image_with_instructions(
+        shuffle["instructions"],
+        shuffle["shuffled_chunk_block_map"],
+        instruction_mode=False
+        )
+    return render_solve_animation(
+        image_graph,
+        shuffle["moves"],
+        chunk_block_map,
+        output_path,
+        start_image=start_image,
+        animation_format=animation_format,
+        duration=frame_duration
+        )
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Render the solve animation of a puzzle.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--image", default=None, help="Source image to draw a puzzle from.")
+    source.add_argument("--frames", default=None, help="Folder of frames saved by generate_images_for_demo.")
+    parser.add_argument("--output", default="demo_solving_puzzle.gif")
+    parser.add_argument("--animation-format", choices=ANIMATION_FORMATS, default="gif")
+    parser.add_argument("--frame-duration", type=int, default=700, help="Milliseconds per frame.")
+    parser.add_argument("--puzzle-complexity", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> None:
+    args = parse_args(argv)
+    if args.frames is not None:
+        create_animated_gif(args.frames, args.output, frame_duration=args.frame_duration)
+        return
+    num_frames = render_demo(
+        args.image,
+        args.output,
+        puzzle_complexity=args.puzzle_complexity,
+        seed=args.seed,
+        animation_format=args.animation_format,
+        frame_duration=args.frame_duration
+        )
+    print(f"Wrote {num_frames} frames to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Background threads that overlap image decoding and PNG writing with puzzle generation.
+
+Sampling, planning and compositing stay on the calling thread. Decoding (`Prefetcher`)
+and PNG encoding plus writing (`AsyncSampleWriter`) run on helper threads; Pillow releases
+the GIL in its decoders and zlib encoder, so they progress while the caller computes.
+Both are bounded: the prefetcher holds at most `depth` decoded images ahead of the caller,
+and the writer blocks the caller once `max_pending` images wait to be written.
+
+Example:
+    writer = AsyncSampleWriter(FolderSampleWriter("dataset", metadata), num_threads=2)
+    for image_path, image_graph in Prefetcher(image_paths, ImageGraph, depth=2):
+        ...
+        writer.write_sample(key, image, record)
+    writer.close()
+"""
+import queue
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import instrumentation
+
+_DONE = object()
+
+
+class Prefetcher:
+    """Iterate over `(item, loader(item))` with up to `depth` items loaded ahead on a thread.
+
+    An exception raised by `loader` is re-raised by the iterator at that item.
+    """
+
+    def __init__(self, items: typing.Iterable, loader: typing.Callable, depth: int = 2) -> None:
+        self.items = items
+        self.loader = loader
+        self._queue = queue.Queue(maxsize=max(depth, 1))
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        for item in self.items:
+            if self._stopped.is_set():
+                return
+            try:
+                result, error = self.loader(item), None
+            except Exception as exception:
+                result, error = None, exception
+            self._put((item, result, error))
+        self._put(_DONE)
+
+    def _put(self, entry) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        try:
+            while True:
+                with instrumentation.span("prefetch_wait"):
+                    entry = self._queue.get()
+                if entry is _DONE:
+                    return
+                item, result, error = entry
+                if error is not None:
+                    raise error
+                yield item, result
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._stopped.set()
+
+
+class AsyncSampleWriter:
+    """Encode and write samples of a sample writer on a thread pool.
+
+    Encoding runs concurrently; `write_encoded` calls on the wrapped writer are serialised
+    by a lock, so the wrapped writer and its metadata and manifest sinks need no locking
+    of their own. The first error of a background write is re-raised by the next call.
+    """
+
+    def __init__(self, writer, num_threads: int = 2, max_pending: int = 16) -> None:
+        self.writer = writer
+        self._executor = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="sample-writer")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._error = None
+
+    @property
+    def extension(self) -> str:
+        return self.writer.extension
+
+    def write_sample(self, key: str, image: Image.Image, record: dict, manifest_entry: dict = None) -> None:
+        self._raise_error()
+        with instrumentation.span("write_backpressure"):
+            self._slots.acquire()
+        self._executor.submit(self._write, key, image, record, manifest_entry)
+
+    def _write(self, key: str, image: Image.Image, record: dict, manifest_entry: dict) -> None:
+        try:
+            data = self.writer.encode(image)
+            with self._lock:
+                self.writer.write_encoded(key, data, record, manifest_entry)
+        except BaseException as exception:
+            if self._error is None:
+                self._error = exception
+        finally:
+            self._slots.release()
+
+    def flush(self) -> None:
+        """Flush what the wrapped writer holds, without waiting for queued samples."""
+        self._raise_error()
+        with self._lock:
+            self.writer.flush()
+
+    def close(self) -> None:
+        """Wait for every queued sample, then close the wrapped writer."""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self.writer.close()
+        self._raise_error()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def __enter__(self) -> "AsyncSampleWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
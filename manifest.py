@@ -0,0 +1,89 @@
+"""Record of the puzzles already generated into an output folder.
+
+Every puzzle gets an id derived from the SHA-256 of its source image content, the file
+name of the image (which names the output files), the fingerprint of the generation
+settings that shape it and its index among the puzzles of the image. Workers append one
+manifest entry per puzzle once the puzzle is durably written, to their own part file
+under `<output>/_manifest_parts/`. A re-run loads the parts and skips every puzzle whose
+id is already listed. Unchanged source images whose puzzles are all done are recognised
+by path, size and modification time, without being read at all.
+"""
+import hashlib
+import os
+
+from metadata_writer import MetadataWriter, iter_metadata_parts
+
+MANIFEST_PARTS_FOLDER = "_manifest_parts"
+
+
+def file_content_hash(path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 hex digest of the file at `path`."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def puzzle_id(content_hash: str, source_name: str, fingerprint: str, index: int) -> str:
+    """Id of puzzle `index` of the image `source_name`, the file name without its folder.
+
+    Images with the same content under different names get their own puzzles, as they do
+    in a fresh run.
+    """
+    return hashlib.sha256(
+        f"{content_hash}:{source_name}:{fingerprint}:{index}".encode("utf-8")
+    ).hexdigest()[:32]
+
+
+def source_entry(path: str, content_hash: str) -> dict:
+    """The manifest fields identifying the source image of a puzzle."""
+    stat = os.stat(path)
+    return {
+        "source": os.path.basename(path),
+        "source_hash": content_hash,
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns
+    }
+
+
+class Manifest:
+    """The puzzle ids listed in the manifest parts of `output_folder`."""
+
+    def __init__(self, output_folder: str) -> None:
+        # Puzzle id -> canonical key of the puzzle written under it (None in old entries).
+        self.completed = {}
+        # Canonical keys of the listed puzzles, see `puzzle_index.canonical_puzzle_key`.
+        self.puzzle_keys = set()
+        self._hashes_by_stat = {}
+        for entry in iter_metadata_parts(output_folder, MANIFEST_PARTS_FOLDER):
+            self.completed[entry["puzzle_id"]] = entry.get("puzzle_key")
+            if "puzzle_key" in entry:
+                self.puzzle_keys.add(entry["puzzle_key"])
+            stat_key = (entry["source"], entry["source_size"], entry["source_mtime_ns"])
+            self._hashes_by_stat[stat_key] = entry["source_hash"]
+
+    def __contains__(self, puzzle: str) -> bool:
+        return puzzle in self.completed
+
+    def __len__(self) -> int:
+        return len(self.completed)
+
+    def cached_content_hash(self, path: str) -> str:
+        """Content hash recorded for `path` if the file did not change since, else None."""
+        stat = os.stat(path)
+        return self._hashes_by_stat.get((os.path.basename(path), stat.st_size, stat.st_mtime_ns))
+
+    def is_complete(self, path: str, fingerprint: str, num_puzzles: int) -> bool:
+        """Whether all `num_puzzles` puzzles of the unchanged image at `path` are listed."""
+        content_hash = self.cached_content_hash(path)
+        if content_hash is None:
+            return False
+        source_name = os.path.basename(path)
+        return all(
+            puzzle_id(content_hash, source_name, fingerprint, i) in self.completed for i in range(num_puzzles)
+        )
+
+
+def open_manifest_writer(output_folder: str, part_name: str = None) -> MetadataWriter:
+    return MetadataWriter(output_folder, part_name=part_name, parts_folder=MANIFEST_PARTS_FOLDER)
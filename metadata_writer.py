@@ -0,0 +1,153 @@
+"""Append-only metadata sink for the puzzle dataset.
+
+Every writer appends JSON lines to its own part file under `<output>/_metadata_parts/`, so
+concurrent workers never write to the same file and the cost per puzzle stays constant.
+`merge_metadata` combines the parts into the single `metadata.csv` / `metadata.jsonl` that
+the Hugging Face `imagefolder` loader expects.
+
+Example:
+    python metadata_writer.py dataset --format csv
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+import uuid
+
+METADATA_PARTS_FOLDER = "_metadata_parts"
+
+
+class MetadataWriter:
+    """Buffered JSONL writer for metadata records.
+
+    Records are written out every `flush_every` records or `flush_interval` seconds,
+    whichever comes first, and on `flush`/`close`. Other append-only logs (e.g. the
+    generation manifest) reuse it with their own `parts_folder`.
+    """
+
+    def __init__(
+            self,
+            output_folder: str,
+            part_name: str = None,
+            flush_every: int = 64,
+            flush_interval: float = 5.0,
+            parts_folder: str = METADATA_PARTS_FOLDER
+            ) -> None:
+        parts_folder = os.path.join(output_folder, parts_folder)
+        os.makedirs(parts_folder, exist_ok=True)
+        if part_name is None:
+            part_name = f"metadata-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.path = os.path.join(parts_folder, f"{part_name}.jsonl")
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.records_written = 0
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def append(self, record: dict) -> None:
+        """Queue one record; has the same signature as `list.append` so it can replace a list."""
+        self._buffer.append(json.dumps(record, ensure_ascii=False))
+        if (len(self._buffer) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._file.write("\n".join(self._buffer) + "\n")
+            self.records_written += len(self._buffer)
+            self._buffer = []
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self) -> "MetadataWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def iter_metadata_parts(output_folder: str, parts_folder: str = METADATA_PARTS_FOLDER):
+    """Yield every record stored in the part files of `output_folder`, oldest part first."""
+    part_paths = glob.glob(os.path.join(output_folder, parts_folder, "*.jsonl"))
+    for part_path in sorted(part_paths, key=os.path.getmtime):
+        with open(part_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def merge_metadata(output_folder: str, output_format: str = "csv", remove_parts: bool = False) -> str:
+    """Merge all part files into one metadata file sorted by `file_name`.
+
+    When the same `file_name` was written more than once (e.g. by a rerun), the newest
+    record wins. Returns the path of the merged file.
+    """
+    records = {}
+    for record in iter_metadata_parts(output_folder):
+        records[record["file_name"]] = record
+    merged = [records[file_name] for file_name in sorted(records)]
+
+    output_path = os.path.join(output_folder, f"metadata.{output_format}")
+    tmp_path = f"{output_path}.tmp"
+    if output_format == "jsonl":
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in merged:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    elif output_format == "csv":
+        fieldnames = []
+        for record in merged:
+            fieldnames.extend(key for key in record if key not in fieldnames)
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            for record in merged:
+                writer.writerow({
+                    key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                    for key, value in record.items()
+                })
+    else:
+        raise ValueError(f"Unsupported metadata format: {output_format}")
+    os.replace(tmp_path, output_path)
+
+    if remove_parts:
+        for part_path in glob.glob(os.path.join(output_folder, METADATA_PARTS_FOLDER, "*.jsonl")):
+            os.remove(part_path)
+    return output_path
+
+
+def read_metadata(path: str):
+    """Yield the records of a merged `metadata.csv` or `metadata.jsonl` file.
+
+    JSON encoded CSV columns (board positions) are decoded back into lists and dicts.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+        for record in csv.DictReader(f):
+            for key, value in record.items():
+                if isinstance(value, str) and value[:1] in ("{", "["):
+                    record[key] = json.loads(value)
+            yield record
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge metadata part files into one file.")
+    parser.add_argument("output_folder")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--remove-parts", action="store_true")
+    args = parser.parse_args()
+    print(merge_metadata(args.output_folder, args.format, args.remove_parts))
@@ -0,0 +1,197 @@
+"""Collision-free planning of moves for several displaced blocks.
+
+`PathFinder` plans every block on an empty board, so paths of different blocks can run
+through each other. `PrioritizedPlanner` moves one block at a time along an A* path that
+avoids every other block, choosing at each point the highest priority block that can
+still reach its goal. When no block can move, it starts over with another priority order
+until the node or time budget runs out.
+
+A move sequence that is collision-free in one direction is also collision-free when
+reversed, so the plan can shuffle the blocks away from their original positions and its
+inverse is the solution of the puzzle.
+"""
+import heapq
+import random
+import time
+import typing
+
+import instrumentation
+from create_graph_dataset import DIRECTION_VECTORS
+
+
+class PlanningError(ValueError):
+    """Raised when no collision-free plan is found within the node budget."""
+
+
+class PlanningTimeout(RuntimeError):
+    """Raised when a plan exceeds the wall-clock `time_budget`.
+
+    Unlike `PlanningError` it must not lead to a redraw: whether it happens depends on the
+    machine and its load, and a redraw would change every later draw of the shared rng.
+    """
+
+
+class PlannerStats:
+    """Counters of one or more planner runs."""
+
+    FIELDS = (
+        "plans", "failures", "searches", "nodes_expanded", "orderings_tried",
+        "num_moves", "lower_bound", "elapsed_seconds"
+        )
+
+    def __init__(self) -> None:
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def merge(self, other: "PlannerStats") -> None:
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def as_dict(self) -> dict:
+        stats = {field: getattr(self, field) for field in self.FIELDS}
+        # How many moves the plans needed on top of the sum of Manhattan distances.
+        stats["detour_ratio"] = self.num_moves / self.lower_bound - 1 if self.lower_bound else 0.0
+        return stats
+
+
+class PrioritizedPlanner:
+    """Prioritized planning with per-block A* searches around the other blocks.
+
+    Args:
+        max_nodes: A* node expansions allowed per `plan` call, over all searches. Running out
+            raises `PlanningError`, which is deterministic.
+        time_budget: Seconds allowed per `plan` call, None for no limit. Running out raises
+            `PlanningTimeout`.
+        max_orderings: Number of priority orders tried before giving up.
+        rng: Random generator used to shuffle the priority order on restarts.
+    """
+
+    def __init__(
+            self,
+            max_nodes: int = 100_000,
+            time_budget: float = None,
+            max_orderings: int = 16,
+            rng: random.Random = None
+            ) -> None:
+        self.max_nodes = max_nodes
+        self.time_budget = time_budget
+        self.max_orderings = max_orderings
+        self.rng = rng if rng is not None else random.Random(0)
+        self.stats = PlannerStats()
+        self.last_stats = PlannerStats()
+
+    def plan(self, graph, goals: dict) -> typing.List[typing.Tuple[typing.Any, str]]:
+        """Plan moves that bring every chunk in `goals` to its goal cell.
+
+        `graph` is only read: chunks that are not in `goals` are obstacles. Returns the moves
+        as an ordered list of `(chunk, direction)` pairs, or raises `PlanningError`.
+        """
+        stats = PlannerStats()
+        started = time.perf_counter()
+        self._deadline = started + self.time_budget if self.time_budget is not None else None
+        self._nodes_left = self.max_nodes
+        try:
+            with instrumentation.span("plan"):
+                moves = self._plan(graph, goals, stats)
+        finally:
+            stats.elapsed_seconds = time.perf_counter() - started
+            self.last_stats = stats
+            self.stats.merge(stats)
+            instrumentation.count("planner_nodes_expanded", stats.nodes_expanded)
+            instrumentation.count("planner_failures", stats.failures)
+        return moves
+
+    def _plan(self, graph, goals: dict, stats: PlannerStats) -> list:
+        # Blocks with the longest way to go get the first pick by default.
+        priority = sorted(
+            goals,
+            key=lambda chunk: -(abs(chunk.x - goals[chunk][0]) + abs(chunk.y - goals[chunk][1]))
+            )
+        for _ in range(self.max_orderings):
+            stats.orderings_tried += 1
+            moves = self._plan_ordering(graph, goals, priority, stats)
+            if moves is not None:
+                stats.plans += 1
+                stats.num_moves = len(moves)
+                stats.lower_bound = sum(
+                    abs(chunk.x - goal[0]) + abs(chunk.y - goal[1]) for chunk, goal in goals.items()
+                    )
+                return moves
+            priority = list(priority)
+            self.rng.shuffle(priority)
+        stats.failures += 1
+        raise PlanningError(f"No collision-free plan found in {self.max_orderings} priority orders")
+
+    def _plan_ordering(self, graph, goals: dict, priority: list, stats: PlannerStats) -> list:
+        positions = {chunk: (chunk.x, chunk.y) for chunk in graph.chunks}
+        occupied = set(positions.values())
+        remaining = [chunk for chunk in priority if positions[chunk] != goals[chunk]]
+        moves = []
+
+        while remaining:
+            for chunk in remaining:
+                start = positions[chunk]
+                occupied.discard(start)
+                path = self._search(graph.width, graph.height, start, goals[chunk], occupied, stats)
+                if path is not None:
+                    break
+                occupied.add(start)
+            else:
+                # Every remaining block is walled in by the others.
+                return None
+
+            moves.extend((chunk, direction) for direction in path)
+            positions[chunk] = goals[chunk]
+            occupied.add(goals[chunk])
+            remaining.remove(chunk)
+        return moves
+
+    def _search(self, width: int, height: int, start: tuple, goal: tuple, occupied: set, stats: PlannerStats):
+        """A* from `start` to `goal` avoiding `occupied`; returns the directions or None."""
+        stats.searches += 1
+        if goal in occupied:
+            return None
+        parents = {start: None}
+        best_cost = {start: 0}
+        # Ties on f are broken towards the deeper node, which reaches the goal sooner.
+        heap = [(abs(goal[0] - start[0]) + abs(goal[1] - start[1]), 0, start)]
+
+        while heap:
+            _, negative_cost, cell = heapq.heappop(heap)
+            cost = -negative_cost
+            if cell == goal:
+                return self._reconstruct(parents, goal)
+            if cost > best_cost[cell]:
+                continue
+
+            stats.nodes_expanded += 1
+            self._nodes_left -= 1
+            if self._nodes_left < 0:
+                raise PlanningError(f"Node budget of {self.max_nodes} expansions exhausted")
+            if (self._deadline is not None and stats.nodes_expanded % 256 == 0
+                    and time.perf_counter() > self._deadline):
+                raise PlanningTimeout(f"Time budget of {self.time_budget}s exhausted")
+
+            for direction, (dx, dy) in DIRECTION_VECTORS.items():
+                next_cell = (cell[0] + dx, cell[1] + dy)
+                if not (0 <= next_cell[0] < width and 0 <= next_cell[1] < height):
+                    continue
+                if next_cell in occupied:
+                    continue
+                next_cost = cost + 1
+                if next_cost < best_cost.get(next_cell, next_cost + 1):
+                    best_cost[next_cell] = next_cost
+                    parents[next_cell] = (cell, direction)
+                    heuristic = abs(goal[0] - next_cell[0]) + abs(goal[1] - next_cell[1])
+                    heapq.heappush(heap, (next_cost + heuristic, -next_cost, next_cell))
+        return None
+
+    @staticmethod
+    def _reconstruct(parents: dict, goal: tuple) -> list:
+        path = []
+        cell = goal
+        while parents[cell] is not None:
+            cell, direction = parents[cell]
+            path.append(direction)
+        path.reverse()
+        return path
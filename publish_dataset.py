@@ -1,5 +1,37 @@
-from datasets import load_dataset
+"""Load the generated dataset and push it to the Hugging Face Hub.
 
-dataset = load_dataset("imagefolder", data_dir="dataset", split="train")
-dataset.push_to_hub("Harshnigm/puzzles-for-vision-llm")
-# print(dataset[0]["instructions"])
\ No newline at end of file
+Folder output is loaded with the `imagefolder` builder. Tar shard output is loaded with
+the `webdataset` builder straight from the shards listed in `shards.json`, so the output
+folder is never scanned.
+
+Example:
+    python publish_dataset.py --data-dir dataset --repo-id Harshnigm/puzzles-for-vision-llm
+"""
+import argparse
+import os
+
+
+def load_generated_dataset(data_dir: str, split: str = "train", streaming: bool = False):
+    # `datasets` and Pillow (via sample_writer) are slow to import, so only loading pays for them,
+    # not `--help`.
+    from datasets import load_dataset
+    from sample_writer import read_shard_index
+    index = read_shard_index(data_dir)
+    if index is None:
+        return load_dataset("imagefolder", data_dir=data_dir, split=split, streaming=streaming)
+    data_files = [os.path.join(data_dir, shard["name"]) for shard in index["shards"]]
+    return load_dataset("webdataset", data_files={split: data_files}, split=split, streaming=streaming)
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Push the generated dataset to the Hugging Face Hub.")
+    parser.add_argument("--data-dir", default="dataset")
+    parser.add_argument("--repo-id", default="Harshnigm/puzzles-for-vision-llm")
+    args = parser.parse_args(argv)
+    dataset = load_generated_dataset(args.data_dir)
+    dataset.push_to_hub(args.repo_id)
+    # print(dataset[0]["instructions"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Index of the puzzles already drawn, to reject duplicates before they are rendered.
+
+A puzzle is identified by a canonical key: the content hash of its source image, the grid
+size and the set of (chunk origin, end cell) pairs it displaces. `PuzzleIndex` holds the
+keys exactly; `BloomFilter` holds them in a fixed number of bits for very large runs, at
+the price of rare false positives, which only cost an extra draw.
+
+Both have the same interface: `key in index` and `index.add(key)`, which returns whether
+the key was new.
+"""
+import hashlib
+import math
+import typing
+
+
+def canonical_puzzle_key(
+        source_hash: str,
+        graph_size: int,
+        displacements: typing.Iterable[typing.Tuple[typing.Tuple[int, int], typing.Tuple[int, int]]]
+        ) -> str:
+    """Key of a puzzle from its `((origin_x, origin_y), (end_x, end_y))` displacements.
+
+    The order of the displacements does not matter.
+    """
+    pairs = ";".join(f"{ox},{oy}>{ex},{ey}" for (ox, oy), (ex, ey) in sorted(displacements))
+    return hashlib.sha256(f"{source_hash}:{graph_size}:{pairs}".encode("utf-8")).hexdigest()[:32]
+
+
+class PuzzleIndex:
+    """Exact in-memory set of puzzle keys."""
+
+    def __init__(self, keys: typing.Iterable[str] = ()) -> None:
+        self.keys = set(keys)
+
+    def add(self, key: str) -> bool:
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+class BloomFilter:
+    """Bloom filter over puzzle keys, sized for `capacity` keys at `error_rate` false positives."""
+
+    def __init__(self, capacity: int, error_rate: float = 1e-4, keys: typing.Iterable[str] = ()) -> None:
+        capacity = max(capacity, 1)
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        for key in keys:
+            self.add(key)
+
+    def _positions(self, key: str) -> typing.Iterator[int]:
+        # Double hashing: k positions from the two halves of one digest.
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key: str) -> bool:
+        new = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] >> bit & 1:
+                self.bits[byte] |= 1 << bit
+                new = True
+        self.count += new
+        return new
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position // 8] >> (position % 8) & 1 for position in self._positions(key))
+
+    def __len__(self) -> int:
+        """Number of keys added that were not reported as present, an estimate of the size."""
+        return self.count
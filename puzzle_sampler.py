@@ -1,35 +1,86 @@
 import string
 import random
 import itertools
+import functools
+import typing
+
+import instrumentation
+
+
+def block_name(index: int) -> str:
+    """Block tag of the chunk at `index`: A to Z, then AA, AB, ... like spreadsheet columns."""
+    name = ""
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        name = string.ascii_uppercase[remainder] + name
+    return name
+
+# How `sample_chunks_for_shuffle` picks the chunks to move, see `PuzzleSampler`.
+CHUNK_SELECTIONS = ("uniform", "frontier")
+
 
 class PuzzleSampler:
 
-    def __init__(self) -> None:
-        self.graph_size = 11
-        self.puzzle_complexity = 2
-        self.puzzle_distance_thr = 3
+    def __init__(
+            self,
+            graph_size: int = 11,
+            puzzle_complexity: int = 2,
+            puzzle_distance_thr: int = 3,
+            rng: random.Random = None,
+            chunk_selection: str = "uniform"
+            ) -> None:
+        self.graph_size = graph_size
+        self.puzzle_complexity = puzzle_complexity
+        # Maximum Manhattan distance between a chunk and its end cell, None for no limit.
+        self.puzzle_distance_thr = puzzle_distance_thr
+        # Falls back to the module level generator so existing callers keep their behaviour.
+        self.rng = rng if rng is not None else random
+        if chunk_selection not in CHUNK_SELECTIONS:
+            raise ValueError(f"Unknown chunk selection {chunk_selection!r}, expected one of {CHUNK_SELECTIONS}")
+        self.chunk_selection = chunk_selection
+        # Puzzles drawn by `sample_end_coords`, to draw them without replacement.
+        self.drawn_puzzles = set()
         
     def map_chunks_to_block_names(self, graphs):
-        """Map chunks to blocks A, B, C D....
+        """Map chunks to blocks A, B, C D..., continuing with AA, AB... past Z.
         """
-        chunks = graphs.chunks
-        block_mapping = {}
-        block_list = list(string.ascii_uppercase)
-        block_index = 0
-        for chunk in chunks:
-            block_mapping[chunk] = block_list[block_index]
-            block_index = block_index + 1
-        return block_mapping
+        return {chunk: block_name(block_index) for block_index, chunk in enumerate(graphs.chunks)}
     
     def sample_chunks_for_shuffle(self, graph):
+        if self.chunk_selection == "frontier":
+            return self._sample_frontier_chunks(graph)
         chunks = graph.chunks
-        sampled_chunks = random.sample(chunks, self.puzzle_complexity)
+        sampled_chunks = self.rng.sample(chunks, self.puzzle_complexity)
+        return sampled_chunks
+
+    def _sample_frontier_chunks(self, graph) -> list:
+        """Draw chunks that can leave the tiling one after the other.
+
+        Every drawn chunk touches a free cell or a chunk drawn before it. On large tilings a
+        uniform draw mostly picks interior chunks walled in by the others, which no planner
+        can move; chunks drawn this way can be moved out in the order they were drawn.
+        """
+        def touches_free_cell(chunk) -> bool:
+            return any(not graph.is_occupied(*cell) for _, cell in graph.neighbours(chunk.x, chunk.y))
+
+        frontier = [chunk for chunk in graph.chunks if touches_free_cell(chunk)]
+        sampled_chunks = []
+        for _ in range(self.puzzle_complexity):
+            if not frontier:
+                raise ValueError(f"Cannot draw {self.puzzle_complexity} chunks from {len(graph.chunks)}")
+            chunk = frontier.pop(self.rng.randrange(len(frontier)))
+            sampled_chunks.append(chunk)
+            for _, cell in graph.neighbours(chunk.x, chunk.y):
+                neighbour = graph.chunk_at(*cell)
+                if neighbour is not None and neighbour not in sampled_chunks and neighbour not in frontier:
+                    frontier.append(neighbour)
         return sampled_chunks
     
     def filter_combination_end_indices(self, sampled_chunks: list, combinations: list):
         filtered_end_coords = []
-        assert len(sampled_chunks) == len(combination)
-        for combination in combination:
+        assert all(len(sampled_chunks) == len(combination) for combination in combinations)
+        for combination in combinations:
             flag = True
             for end_corrds_indices in range(len(combination)):
                 end_coords = combination[end_corrds_indices]
@@ -55,6 +106,61 @@ class PuzzleSampler:
         combinations = list(itertools.combinations(non_chunk_indices_pairs, self.puzzle_complexity))
         return combinations
     
+    def sample_end_coords(self, graph, sampled_chunks: list, unique: bool = True, max_attempts: int = 1000) -> tuple:
+        """Draw one end cell per sampled chunk without listing all the combinations.
+
+        End cells are free, distinct and at most `puzzle_distance_thr` away from their chunk:
+        each one is drawn from the chunk's Manhattan ball and redrawn when it is invalid. With
+        `unique`, a puzzle (chunks and end cells) that this sampler already returned is redrawn
+        too, so repeated calls draw puzzles without replacement.
+        """
+        for _ in range(max_attempts):
+            instrumentation.count("end_coord_draws")
+            end_coords = self._draw_end_coords(graph, sampled_chunks, max_attempts)
+            if not unique:
+                return end_coords
+            puzzle_key = frozenset(
+                ((chunk.x, chunk.y), end_coord) for chunk, end_coord in zip(sampled_chunks, end_coords)
+            )
+            if puzzle_key not in self.drawn_puzzles:
+                self.drawn_puzzles.add(puzzle_key)
+                return end_coords
+        raise ValueError(f"No new end coordinates found in {max_attempts} draws")
+
+    def iter_end_coords(self, graph, sampled_chunks: list, count: int) -> typing.Iterator[tuple]:
+        """Yield `count` distinct end coordinate tuples for the same sampled chunks."""
+        for _ in range(count):
+            yield self.sample_end_coords(graph, sampled_chunks, unique=True)
+
+    def _draw_end_coords(self, graph, sampled_chunks: list, max_attempts: int) -> tuple:
+        end_coords = []
+        for chunk in sampled_chunks:
+            for _ in range(max_attempts):
+                if self.puzzle_distance_thr is None:
+                    end_coord = (self.rng.randrange(graph.width), self.rng.randrange(graph.height))
+                else:
+                    dx, dy = self.rng.choice(self._ball_offsets(self.puzzle_distance_thr))
+                    end_coord = (chunk.x + dx, chunk.y + dy)
+                if (graph.in_bounds(*end_coord)
+                        and not graph.is_occupied(*end_coord)
+                        and end_coord not in end_coords):
+                    end_coords.append(end_coord)
+                    break
+            else:
+                raise ValueError(f"No free end cell within {self.puzzle_distance_thr} of {(chunk.x, chunk.y)}")
+        return tuple(end_coords)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _ball_offsets(radius: int) -> tuple:
+        """Offsets at Manhattan distance 1 to `radius`, shared by all samplers."""
+        return tuple(
+            (dx, dy)
+            for dx in range(-radius, radius + 1)
+            for dy in range(-radius, radius + 1)
+            if 0 < abs(dx) + abs(dy) <= radius
+        )
+
     @staticmethod
     def map_chunks_to_indices(chunks_to_move: list, end_coords_list: list) -> dict:
         chunk_to_end_coords_map = {}
@@ -0,0 +1,328 @@
+"""Sinks for the generated puzzle samples.
+
+A sample is a puzzle image plus its metadata record. `FolderSampleWriter` keeps the
+original layout: one PNG per puzzle in the output folder, next to the metadata written
+by a `MetadataWriter`. `TarShardWriter` packs samples into WebDataset style tar shards
+(`<key>.png` or the extension of the encoder, followed by `<key>.json`) of a bounded size. Every finished shard is recorded
+in a per-writer index part, and `write_shard_index` merges the parts into `shards.json`.
+Loaders read the shards sequentially from that index without scanning the output folder.
+
+Both writers share the same three steps, `encode`, `write_encoded` and their composition
+`write_sample`, so the encoding can be done elsewhere than the writing. Images are encoded
+with an `image_encoders.ImageEncoder`, PNG by default. A sample may
+carry a manifest entry, which is appended to `manifest` once the sample is durable.
+
+Example:
+    with TarShardWriter("dataset", metadata=[]) as writer:
+        writer.write_sample("img_0", image, {"file_name": "img_0.png", "instructions": ...})
+    write_shard_index("dataset")
+"""
+import glob
+import io
+import json
+import os
+import tarfile
+import time
+import uuid
+
+from PIL import Image
+
+import instrumentation
+from image_encoders import ImageEncoder
+
+SHARD_INDEX_FILE = "shards.json"
+SHARD_PARTS_FOLDER = "_shard_parts"
+# Index part holding the entries merged by `write_shard_index`.
+MERGED_SHARD_PART = "merged.jsonl"
+
+
+class FolderSampleWriter:
+    """Write each sample as `<output_folder>/<key>.png` and append its record to `metadata`."""
+
+    def __init__(self, output_folder: str, metadata, manifest=None, encoder: ImageEncoder = None) -> None:
+        self.output_folder = output_folder
+        self.metadata = metadata
+        self.manifest = manifest
+        self.encoder = encoder if encoder is not None else ImageEncoder()
+
+    @property
+    def extension(self) -> str:
+        return self.encoder.extension
+
+    def encode(self, image: Image.Image) -> bytes:
+        return self.encoder.encode(image)
+
+    def write_encoded(self, key: str, data: bytes, record: dict, manifest_entry: dict = None) -> None:
+        self.metadata.append(record)
+        with instrumentation.span("write"):
+            with open(os.path.join(self.output_folder, f"{key}.{self.extension}"), "wb") as f:
+                f.write(data)
+        instrumentation.count("bytes_written", len(data))
+        if manifest_entry is not None and self.manifest is not None:
+            self.manifest.append(manifest_entry)
+
+    def write_sample(self, key: str, image: Image.Image, record: dict, manifest_entry: dict = None) -> None:
+        self.write_encoded(key, self.encode(image), record, manifest_entry)
+
+    def flush(self) -> None:
+        """Flush the metadata and manifest sinks, when they buffer."""
+        for sink in (self.metadata, self.manifest):
+            if hasattr(sink, "flush"):
+                sink.flush()
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class TarShardWriter(FolderSampleWriter):
+    """Append samples to tar shards of at most `max_shard_bytes` / `max_shard_samples`.
+
+    A shard is written as `<name>.tar.tmp` and only renamed to `<name>.tar` and added to
+    the index once it is complete, so an interrupted run never leaves a truncated shard
+    behind; `write_shard_index` removes the `.tmp` files of crashed writers. Records
+    appended to `metadata` get the name of their shard in `shard`;
+    manifest entries are held back until their shard is complete.
+    """
+
+    def __init__(
+            self,
+            output_folder: str,
+            metadata=None,
+            manifest=None,
+            encoder: ImageEncoder = None,
+            part_name: str = None,
+            max_shard_bytes: int = 256 * 1024 * 1024,
+            max_shard_samples: int = None
+            ) -> None:
+        super().__init__(output_folder, metadata, manifest, encoder)
+        if part_name is None:
+            part_name = f"shard-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.part_name = part_name
+        self.max_shard_bytes = max_shard_bytes
+        self.max_shard_samples = max_shard_samples
+        self.shards_written = 0
+        self._tar = None
+        self._shard_name = None
+        self._shard_samples = 0
+        self._shard_bytes = 0
+        self._shard_keys = []
+        self._pending_manifest = []
+        parts_folder = os.path.join(output_folder, SHARD_PARTS_FOLDER)
+        os.makedirs(parts_folder, exist_ok=True)
+        self._index_path = os.path.join(parts_folder, f"{part_name}.jsonl")
+
+    def write_encoded(self, key: str, data: bytes, record: dict, manifest_entry: dict = None) -> None:
+        # WebDataset splits member names at the first dot into key and extension.
+        key = key.replace(".", "_")
+        if self._tar is not None and self._shard_is_full():
+            self._close_shard()
+        if self._tar is None:
+            self._open_shard()
+        record_data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+        with instrumentation.span("write"):
+            self._add_member(f"{key}.{self.extension}", data)
+            self._add_member(f"{key}.json", record_data)
+        self._shard_samples += 1
+        self._shard_keys.append(key)
+        self._shard_bytes += len(data) + len(record_data)
+        instrumentation.count("bytes_written", len(data) + len(record_data))
+        if self.metadata is not None:
+            self.metadata.append({**record, "shard": f"{self._shard_name}.tar"})
+        if manifest_entry is not None:
+            self._pending_manifest.append(manifest_entry)
+
+    def close(self) -> None:
+        if self._tar is not None:
+            self._close_shard()
+
+    def _shard_is_full(self) -> bool:
+        if self.max_shard_samples is not None and self._shard_samples >= self.max_shard_samples:
+            return True
+        return self.max_shard_bytes is not None and self._shard_bytes >= self.max_shard_bytes
+
+    def _open_shard(self) -> None:
+        self._shard_name = f"{self.part_name}-{self.shards_written:05d}"
+        tmp_path = os.path.join(self.output_folder, f"{self._shard_name}.tar.tmp")
+        self._tar = tarfile.open(tmp_path, "w", format=tarfile.USTAR_FORMAT)
+        self._shard_samples = 0
+        self._shard_bytes = 0
+        self._shard_keys = []
+
+    def _add_member(self, name: str, data: bytes) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def _close_shard(self) -> None:
+        tmp_path = self._tar.name
+        self._tar.close()
+        self._tar = None
+        path = tmp_path[:-len(".tmp")]
+        os.replace(tmp_path, path)
+        entry = {
+            "name": os.path.basename(path),
+            "num_samples": self._shard_samples,
+            "num_bytes": os.path.getsize(path),
+            "created": time.time(),
+            "keys": self._shard_keys
+        }
+        with open(self._index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.shards_written += 1
+        instrumentation.count("shards_written")
+        if self.manifest is not None:
+            for manifest_entry in self._pending_manifest:
+                self.manifest.append(manifest_entry)
+            self.manifest.flush()
+        self._pending_manifest = []
+
+
+def _read_shard_parts(output_folder: str) -> dict:
+    """The index entries of all writers by shard name; the merged part is read last and wins."""
+    parts_folder = os.path.join(output_folder, SHARD_PARTS_FOLDER)
+    merged_path = os.path.join(parts_folder, MERGED_SHARD_PART)
+    part_paths = sorted(path for path in glob.glob(os.path.join(parts_folder, "*.jsonl")) if path != merged_path)
+    if os.path.exists(merged_path):
+        part_paths.append(merged_path)
+    shards = {}
+    for part_path in part_paths:
+        with open(part_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    shards[entry["name"]] = entry
+    return shards
+
+
+def _shard_keys(path: str) -> list:
+    """Sample keys of a shard in member order, for index entries written without them."""
+    keys = []
+    with tarfile.open(path, "r") as tar:
+        for name in tar.getnames():
+            key = name.partition(".")[0]
+            if not keys or keys[-1] != key:
+                keys.append(key)
+    return keys
+
+
+def _rewrite_shard(path: str, keep_keys: set) -> None:
+    """Replace a shard by a copy holding only the samples in `keep_keys`."""
+    tmp_path = f"{path}.tmp"
+    with tarfile.open(path, "r") as source, tarfile.open(tmp_path, "w", format=tarfile.USTAR_FORMAT) as target:
+        for member in source:
+            if member.name.partition(".")[0] in keep_keys:
+                target.addfile(member, source.extractfile(member))
+    os.replace(tmp_path, path)
+
+
+def write_shard_index(output_folder: str) -> str:
+    """Merge the index parts of all writers into `shards.json`; returns its path.
+
+    When a sample key was written to several shards (e.g. by a rerun with `--no-resume`),
+    the sample of the newest shard wins, as in `merge_metadata`. Shards whose samples were
+    all superseded are deleted, shards with some superseded samples are rewritten without
+    them, and `.tar.tmp` files left behind by crashed writers are removed. The merged
+    entries replace the index parts, so the next merge starts from them. Run it only
+    while no writer is active.
+    """
+    for tmp_path in glob.glob(os.path.join(output_folder, "*.tar.tmp")):
+        os.remove(tmp_path)
+    shards = _read_shard_parts(output_folder)
+    entries = []
+    for name in sorted(shards):
+        entry = shards[name]
+        path = os.path.join(output_folder, name)
+        if not os.path.exists(path):
+            continue
+        if "keys" not in entry:
+            entry["keys"] = _shard_keys(path)
+        entry.setdefault("created", os.path.getmtime(path))
+        entries.append(entry)
+    entries.sort(key=lambda entry: (entry["created"], entry["name"]))
+    owners = {}
+    for entry in entries:
+        for key in entry["keys"]:
+            owners[key] = entry["name"]
+    live_entries = []
+    for entry in entries:
+        path = os.path.join(output_folder, entry["name"])
+        keys = [key for key in entry["keys"] if owners[key] == entry["name"]]
+        if not keys:
+            os.remove(path)
+            continue
+        if len(keys) < len(entry["keys"]):
+            _rewrite_shard(path, set(keys))
+            entry = {**entry, "num_samples": len(keys), "num_bytes": os.path.getsize(path), "keys": keys}
+        live_entries.append(entry)
+    live_entries.sort(key=lambda entry: entry["name"])
+
+    parts_folder = os.path.join(output_folder, SHARD_PARTS_FOLDER)
+    os.makedirs(parts_folder, exist_ok=True)
+    merged_path = os.path.join(parts_folder, MERGED_SHARD_PART)
+    with open(f"{merged_path}.tmp", "w", encoding="utf-8") as f:
+        for entry in live_entries:
+            f.write(json.dumps(entry) + "\n")
+    os.replace(f"{merged_path}.tmp", merged_path)
+    for part_path in glob.glob(os.path.join(parts_folder, "*.jsonl")):
+        if part_path != merged_path:
+            os.remove(part_path)
+
+    shard_entries = [
+        {key: value for key, value in entry.items() if key not in ("keys", "created")}
+        for entry in live_entries
+    ]
+    index = {
+        "format": "webdataset",
+        "num_samples": sum(entry["num_samples"] for entry in shard_entries),
+        "shards": shard_entries
+    }
+    output_path = os.path.join(output_folder, SHARD_INDEX_FILE)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def read_shard_index(output_folder: str) -> dict:
+    """Return the parsed `shards.json` of `output_folder`, or None if it has none."""
+    path = os.path.join(output_folder, SHARD_INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_shard_samples(output_folder: str):
+    """Stream the samples of every indexed shard as `{"key", "image", "record"}` dicts.
+
+    `image` holds the encoded image bytes. Shards are read front to back in index order.
+    """
+    index = read_shard_index(output_folder)
+    if index is None:
+        raise FileNotFoundError(f"No {SHARD_INDEX_FILE} in {output_folder}")
+    for shard in index["shards"]:
+        with tarfile.open(os.path.join(output_folder, shard["name"]), "r|") as tar:
+            sample = {}
+            for member in tar:
+                key, _, extension = member.name.partition(".")
+                if sample and sample["key"] != key:
+                    yield sample
+                    sample = {}
+                data = tar.extractfile(member).read()
+                sample["key"] = key
+                if extension == "json":
+                    sample["record"] = json.loads(data)
+                else:
+                    sample["image"] = data
+            if sample:
+                yield sample
@@ -0,0 +1,285 @@
+"""Headless verification of instruction strings against puzzle boards.
+
+A solution is the comma separated "Move block X dir" string stored in the metadata (or
+produced by a model). `verify_records` replays solutions for whole batches of puzzles at
+once on NumPy arrays, starting from the `blocks` positions recorded in the metadata, and
+reports per puzzle whether it ends solved, partially solved or with an illegal move. No
+image is decoded or rendered.
+
+Example:
+    python solution_verifier.py dataset/metadata.csv
+    python solution_verifier.py dataset/metadata.csv --predictions model_answers.jsonl
+"""
+import argparse
+import functools
+import json
+import typing
+
+import numpy as np
+
+from metadata_writer import read_metadata
+
+DIRECTIONS = ("up", "down", "left", "right")
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+DIRECTION_DELTAS = np.array([(0, -1), (0, 1), (-1, 0), (1, 0)], dtype=np.int32)
+
+# Block codes of a parsed move besides the block index.
+PAD = -1
+INVALID = -2
+
+STATUSES = ("solved", "partial", "illegal")
+ILLEGAL_REASONS = ("unparseable", "unknown_block", "off_board", "collision")
+# Position of blocks a puzzle does not have, far away from every board.
+ABSENT = -(1 << 20)
+
+
+def parse_instructions(instructions: str) -> typing.List[typing.Tuple[str, str]]:
+    """Split an instruction string into (block tag, direction) pairs.
+
+    Steps that are not of the form "Move block X dir" come back as (None, None).
+    """
+    if not instructions:
+        return []
+    return [_parse_step(step) for step in instructions.split(",")]
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_step(step: str) -> typing.Tuple[str, str]:
+    # The same few dozen steps repeat across a dataset, so parsed steps are memoised.
+    tokens = step.split()
+    if (len(tokens) == 4 and tokens[0].lower() == "move" and tokens[1].lower() == "block"
+            and tokens[3].lower() in DIRECTION_CODES):
+        return tokens[2].upper(), tokens[3].lower()
+    return None, None
+
+
+class VerificationResult:
+    """Per puzzle outcome arrays of one `verify_batch` call."""
+
+    def __init__(self, file_names, status, steps, num_moves, blocks_at_goal, illegal_reason) -> None:
+        self.file_names = file_names
+        self.status = status
+        self.steps = steps
+        self.num_moves = num_moves
+        self.blocks_at_goal = blocks_at_goal
+        self.illegal_reason = illegal_reason
+
+    def records(self) -> typing.Iterator[dict]:
+        for i, file_name in enumerate(self.file_names):
+            yield {
+                "file_name": file_name,
+                "status": STATUSES[self.status[i]],
+                "steps": int(self.steps[i]),
+                "num_moves": int(self.num_moves[i]),
+                "blocks_at_goal": float(self.blocks_at_goal[i]),
+                "illegal_reason": ILLEGAL_REASONS[self.illegal_reason[i]] if self.illegal_reason[i] >= 0 else None
+            }
+
+
+class VerificationReport:
+    """Aggregated counts over any number of `VerificationResult`s."""
+
+    def __init__(self) -> None:
+        self.puzzles = 0
+        self.status_counts = dict.fromkeys(STATUSES, 0)
+        self.illegal_reason_counts = dict.fromkeys(ILLEGAL_REASONS, 0)
+        self.steps = 0
+        self.num_moves = 0
+        self.blocks_at_goal = 0.0
+
+    def add(self, result: VerificationResult) -> None:
+        self.puzzles += len(result.file_names)
+        for code, status in enumerate(STATUSES):
+            self.status_counts[status] += int((result.status == code).sum())
+        for code, reason in enumerate(ILLEGAL_REASONS):
+            self.illegal_reason_counts[reason] += int((result.illegal_reason == code).sum())
+        self.steps += int(result.steps.sum())
+        self.num_moves += int(result.num_moves.sum())
+        self.blocks_at_goal += float(result.blocks_at_goal.sum())
+
+    def as_dict(self) -> dict:
+        puzzles = max(self.puzzles, 1)
+        return {
+            "puzzles": self.puzzles,
+            **self.status_counts,
+            "solved_rate": self.status_counts["solved"] / puzzles,
+            "mean_blocks_at_goal": self.blocks_at_goal / puzzles,
+            "mean_steps_executed": self.steps / puzzles,
+            "mean_moves": self.num_moves / puzzles,
+            "illegal_reasons": self.illegal_reason_counts
+        }
+
+
+def verify_batch(records: list, solutions: list = None, allow_overlap: bool = False) -> VerificationResult:
+    """Replay one solution per record and classify the outcome.
+
+    Args:
+        records: metadata records with `file_name`, `graph_size`, `blocks` and `goals`.
+        solutions: instruction strings to check, defaults to each record's `instructions`.
+        allow_overlap: accept moves onto a cell that holds another block. Datasets made with
+            the legacy planner need this, because their paths run through other blocks.
+    """
+    if solutions is None:
+        solutions = [record["instructions"] for record in records]
+    num_puzzles = len(records)
+    num_blocks = max((len(record["blocks"]) for record in records), default=0)
+
+    positions = np.full((num_puzzles, num_blocks, 2), ABSENT, dtype=np.int32)
+    goals = np.full((num_puzzles, num_blocks, 2), ABSENT, dtype=np.int32)
+    present = np.zeros((num_puzzles, num_blocks), dtype=bool)
+    graph_sizes = np.zeros(num_puzzles, dtype=np.int32)
+    parsed = []
+    for i, (record, solution) in enumerate(zip(records, solutions)):
+        graph_sizes[i] = int(record["graph_size"])
+        tags = sorted(record["blocks"])
+        block_index = {tag: index for index, tag in enumerate(tags)}
+        positions[i, :len(tags)] = [record["blocks"][tag] for tag in tags]
+        goals[i, :len(tags)] = [record["goals"][tag] for tag in tags]
+        present[i, :len(tags)] = True
+        parsed.append([
+            (block_index.get(tag, INVALID), DIRECTION_CODES.get(direction, 0), tag is None)
+            for tag, direction in parse_instructions(solution)
+        ])
+
+    num_steps = max((len(moves) for moves in parsed), default=0)
+    move_blocks = np.full((num_puzzles, num_steps), PAD, dtype=np.int32)
+    move_directions = np.zeros((num_puzzles, num_steps), dtype=np.int8)
+    unparseable = np.zeros((num_puzzles, num_steps), dtype=bool)
+    num_moves = np.zeros(num_puzzles, dtype=np.int32)
+    for i, moves in enumerate(parsed):
+        num_moves[i] = len(moves)
+        if moves:
+            blocks, directions, unparsed = zip(*moves)
+            move_blocks[i, :len(moves)] = blocks
+            move_directions[i, :len(moves)] = directions
+            unparseable[i, :len(moves)] = unparsed
+
+    alive = np.ones(num_puzzles, dtype=bool)
+    steps = np.zeros(num_puzzles, dtype=np.int32)
+    illegal_reason = np.full(num_puzzles, -1, dtype=np.int8)
+
+    for step in range(num_steps):
+        blocks = move_blocks[:, step]
+        invalid = alive & (blocks == INVALID)
+        illegal_reason[invalid & unparseable[:, step]] = ILLEGAL_REASONS.index("unparseable")
+        illegal_reason[invalid & ~unparseable[:, step]] = ILLEGAL_REASONS.index("unknown_block")
+        alive &= ~invalid
+
+        rows = np.nonzero(alive & (blocks >= 0))[0]
+        if rows.size == 0:
+            continue
+        moved = blocks[rows]
+        targets = positions[rows, moved] + DIRECTION_DELTAS[move_directions[rows, step]]
+        size = graph_sizes[rows, None]
+        off_board = ((targets < 0) | (targets >= size)).any(axis=1)
+        bad = off_board
+        if not allow_overlap:
+            collision = (positions[rows] == targets[:, None, :]).all(axis=2).any(axis=1) & ~off_board
+            bad = off_board | collision
+            illegal_reason[rows[collision]] = ILLEGAL_REASONS.index("collision")
+        illegal_reason[rows[off_board]] = ILLEGAL_REASONS.index("off_board")
+        alive[rows[bad]] = False
+
+        good = ~bad
+        positions[rows[good], moved[good]] = targets[good]
+        steps[rows[good]] += 1
+
+    at_goal = (positions == goals).all(axis=2) & present
+    blocks_at_goal = at_goal.sum(axis=1) / np.maximum(present.sum(axis=1), 1)
+    status = np.where(
+        ~alive,
+        STATUSES.index("illegal"),
+        np.where(at_goal.sum(axis=1) == present.sum(axis=1), STATUSES.index("solved"), STATUSES.index("partial"))
+        ).astype(np.int8)
+    return VerificationResult(
+        [record["file_name"] for record in records],
+        status,
+        steps,
+        num_moves,
+        blocks_at_goal,
+        illegal_reason
+        )
+
+
+def verify_records(
+        records: typing.Iterable[dict],
+        predictions: dict = None,
+        allow_overlap: bool = False,
+        batch_size: int = 65536
+        ) -> typing.Tuple[VerificationReport, list]:
+    """Verify a stream of records in batches of `batch_size` puzzles.
+
+    `predictions` maps file names to instruction strings to score instead of the ground
+    truth; records without a prediction are checked against an empty answer. Returns the
+    aggregated report and the per puzzle results.
+    """
+    report = VerificationReport()
+    results = []
+    batch = []
+
+    def flush():
+        solutions = None
+        if predictions is not None:
+            solutions = [predictions.get(record["file_name"], "") for record in batch]
+        result = verify_batch(batch, solutions, allow_overlap=allow_overlap)
+        report.add(result)
+        results.append(result)
+        batch.clear()
+
+    for record in records:
+        if "blocks" not in record or "goals" not in record:
+            raise ValueError(
+                f"{record.get('file_name')} has no board state; regenerate the metadata to verify it"
+                )
+        batch.append(record)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return report, results
+
+
+def load_predictions(path: str, field: str = "instructions") -> dict:
+    """Read a JSONL file of `{"file_name": ..., field: ...}` answers."""
+    predictions = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                predictions[record["file_name"]] = record.get(field) or ""
+    return predictions
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay and verify puzzle solutions.")
+    parser.add_argument("metadata", help="Merged metadata.csv or metadata.jsonl.")
+    parser.add_argument("--predictions", default=None, help="JSONL answers to score instead of the ground truth.")
+    parser.add_argument("--prediction-field", default="instructions")
+    parser.add_argument("--allow-overlap", action="store_true", help="Accept moves through other blocks.")
+    parser.add_argument("--batch-size", type=int, default=65536)
+    parser.add_argument("--details", default=None, help="Write per puzzle results to this JSONL file.")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> None:
+    args = parse_args(argv)
+    predictions = None
+    if args.predictions is not None:
+        predictions = load_predictions(args.predictions, args.prediction_field)
+    report, results = verify_records(
+        read_metadata(args.metadata),
+        predictions,
+        allow_overlap=args.allow_overlap,
+        batch_size=args.batch_size
+        )
+    if args.details is not None:
+        with open(args.details, "w", encoding="utf-8") as f:
+            for result in results:
+                for record in result.records():
+                    f.write(json.dumps(record) + "\n")
+    print(json.dumps(report.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
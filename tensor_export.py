@@ -0,0 +1,253 @@
+"""Render-free export of puzzles as memory-mappable NumPy arrays.
+
+Every puzzle is stored as its board state and solution instead of pixels:
+
+    grids         int8   (N, G, G)   tile index on each cell of the puzzle, [y, x], -1 if empty
+    starts        int16  (N, T, 2)   (x, y) cell of every tile in the puzzle
+    goals         int16  (N, T, 2)   (x, y) cell of every tile once solved
+    moves         uint8  (M,)        solution moves of all puzzles, `tile * 4 + direction`
+    move_offsets  int64  (N + 1,)    puzzle i's moves are moves[move_offsets[i]:move_offsets[i + 1]]
+    keys          bytes  (N,)        puzzle name, the image name of the rendered dataset
+
+Tile indices follow the tile order of `ImageGraph.tiles` (block A is tile 0), so a grid
+plus the source tiles is enough to compose the puzzle image. Directions use the order of
+`solution_verifier.DIRECTIONS`. T is the number of tiles, 9 for the default 3x3 tiling;
+grids are int16 from 128 tiles on and moves uint16 from 65 tiles on.
+
+Workers append puzzles to a `TensorWriter`, which writes a part of `.npy` files under
+`<output>/_tensor_parts/` every `flush_every` puzzles. `merge_tensor_parts` concatenates
+the parts into `<output>/tensors/`, and `load_tensors` maps those files without copying.
+
+Example:
+    tensors = load_tensors("dataset")
+    grid, moves = tensors["grids"][0], decode_moves(tensors["moves"][slice(*tensors["move_offsets"][0:2])])
+"""
+import glob
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+import instrumentation
+from puzzle_sampler import block_name
+from solution_verifier import DIRECTION_CODES, DIRECTIONS
+
+TENSOR_PARTS_FOLDER = "_tensor_parts"
+TENSORS_FOLDER = "tensors"
+ARRAY_NAMES = ("grids", "starts", "goals", "moves", "move_offsets", "keys")
+
+
+def grid_dtype(num_tiles: int) -> np.dtype:
+    return np.dtype(np.int8 if num_tiles <= np.iinfo(np.int8).max else np.int16)
+
+
+def move_dtype(num_tiles: int) -> np.dtype:
+    return np.dtype(np.uint8 if num_tiles * 4 <= np.iinfo(np.uint8).max + 1 else np.uint16)
+
+
+class TensorWriter:
+    """Buffer puzzles as arrays and write them out in parts of `flush_every` puzzles.
+
+    Manifest entries are appended to `manifest` once the part holding their puzzle is on
+    disk. A part is written to a temporary folder and renamed, so parts are never partial.
+    """
+
+    def __init__(
+            self,
+            output_folder: str,
+            graph_size: int = 11,
+            part_name: str = None,
+            manifest=None,
+            flush_every: int = 65536
+            ) -> None:
+        if part_name is None:
+            part_name = f"tensors-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.parts_folder = os.path.join(output_folder, TENSOR_PARTS_FOLDER)
+        os.makedirs(self.parts_folder, exist_ok=True)
+        self.graph_size = graph_size
+        self.part_name = part_name
+        self.manifest = manifest
+        self.flush_every = flush_every
+        self.parts_written = 0
+        self._reset_buffers()
+
+    def _reset_buffers(self) -> None:
+        self._grids = []
+        self._starts = []
+        self._goals = []
+        self._moves = []
+        self._num_moves = []
+        self._keys = []
+        self._pending_manifest = []
+
+    def append(self, key: str, graph, goals: np.ndarray, solution_moves: list, manifest_entry: dict = None) -> None:
+        """Record the current state of `graph` as a puzzle.
+
+        `goals` are the solved (x, y) cells of the chunks in chunk order and `solution_moves`
+        the (chunk, direction) moves that solve the puzzle.
+        """
+        self._grids.append(graph.block_ids.T.astype(grid_dtype(len(graph.chunks))))
+        self._starts.append(graph.positions())
+        self._goals.append(goals)
+        self._moves.extend(chunk.index * 4 + DIRECTION_CODES[direction] for chunk, direction in solution_moves)
+        self._num_moves.append(len(solution_moves))
+        self._keys.append(key)
+        if manifest_entry is not None:
+            self._pending_manifest.append(manifest_entry)
+        instrumentation.count("puzzles_emitted")
+        if len(self._keys) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._keys:
+            return
+        with instrumentation.span("tensor_write"):
+            offsets = np.zeros(len(self._num_moves) + 1, dtype=np.int64)
+            np.cumsum(self._num_moves, out=offsets[1:])
+            arrays = {
+                "grids": np.stack(self._grids),
+                "starts": np.stack(self._starts).astype(np.int16),
+                "goals": np.stack(self._goals).astype(np.int16),
+                "moves": np.array(self._moves, dtype=move_dtype(len(self._starts[0]))),
+                "move_offsets": offsets,
+                "keys": np.array(self._keys, dtype=np.bytes_)
+            }
+            name = f"{self.part_name}-{self.parts_written:05d}"
+            while os.path.exists(os.path.join(self.parts_folder, name)):
+                # Left by an earlier run in a process with the same pid.
+                self.parts_written += 1
+                name = f"{self.part_name}-{self.parts_written:05d}"
+            tmp_folder = os.path.join(self.parts_folder, f"{name}.tmp")
+            os.makedirs(tmp_folder, exist_ok=True)
+            for array_name, array in arrays.items():
+                np.save(os.path.join(tmp_folder, f"{array_name}.npy"), array)
+            os.replace(tmp_folder, os.path.join(self.parts_folder, name))
+        self.parts_written += 1
+        if self.manifest is not None:
+            for manifest_entry in self._pending_manifest:
+                self.manifest.append(manifest_entry)
+            self.manifest.flush()
+        self._reset_buffers()
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "TensorWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _part_folders(output_folder: str) -> list:
+    return sorted(
+        path for path in glob.glob(os.path.join(output_folder, TENSOR_PARTS_FOLDER, "*"))
+        if not path.endswith(".tmp") and os.path.isdir(path)
+    )
+
+
+def merge_tensor_parts(output_folder: str, graph_size: int = None) -> str:
+    """Concatenate all tensor parts into `<output_folder>/tensors/`; returns that folder.
+
+    Arrays are streamed part by part into preallocated `.npy` files, so the merge never
+    holds more than one part in memory. Puzzles whose key appears in several parts (from
+    reruns) are kept once, from the newest part.
+    """
+    parts = _part_folders(output_folder)
+    headers = []
+    newest_part = {}
+    for part in sorted(parts, key=os.path.getmtime):
+        keys = np.load(os.path.join(part, "keys.npy"))
+        headers.append((part, keys))
+        for key in keys.tolist():
+            newest_part[key] = part
+    keep = {part: np.array([newest_part[key] == part for key in keys.tolist()], dtype=bool) for part, keys in headers}
+
+    num_puzzles = sum(int(mask.sum()) for mask in keep.values())
+    num_moves = 0
+    key_width = 1
+    for part, keys in headers:
+        offsets = np.load(os.path.join(part, "move_offsets.npy"))
+        mask = keep[part]
+        num_moves += int((offsets[1:] - offsets[:-1])[mask].sum())
+        if keys.size:
+            key_width = max(key_width, keys.dtype.itemsize)
+    num_tiles = 9
+    if headers:
+        first_part = headers[0][0]
+        num_tiles = np.load(os.path.join(first_part, "starts.npy"), mmap_mode="r").shape[1]
+        if graph_size is None:
+            graph_size = np.load(os.path.join(first_part, "grids.npy"), mmap_mode="r").shape[1]
+    graph_size = graph_size or 0
+
+    tensors_folder = os.path.join(output_folder, TENSORS_FOLDER)
+    tmp_folder = f"{tensors_folder}.tmp"
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    os.makedirs(tmp_folder)
+
+    def open_array(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(tmp_folder, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+    merged = {
+        "grids": open_array("grids", grid_dtype(num_tiles), (num_puzzles, graph_size, graph_size)),
+        "starts": open_array("starts", np.int16, (num_puzzles, num_tiles, 2)),
+        "goals": open_array("goals", np.int16, (num_puzzles, num_tiles, 2)),
+        "moves": open_array("moves", move_dtype(num_tiles), (num_moves,)),
+        "move_offsets": open_array("move_offsets", np.int64, (num_puzzles + 1,)),
+        "keys": open_array("keys", f"S{key_width}", (num_puzzles,))
+    }
+    merged["move_offsets"][0] = 0
+    puzzle_start = 0
+    move_start = 0
+    for part, keys in headers:
+        mask = keep[part]
+        count = int(mask.sum())
+        if count == 0:
+            continue
+        end = puzzle_start + count
+        for name in ("grids", "starts", "goals"):
+            merged[name][puzzle_start:end] = np.load(os.path.join(part, f"{name}.npy"), mmap_mode="r")[mask]
+        merged["keys"][puzzle_start:end] = keys[mask]
+        offsets = np.load(os.path.join(part, "move_offsets.npy"))
+        moves = np.load(os.path.join(part, "moves.npy"), mmap_mode="r")
+        lengths = (offsets[1:] - offsets[:-1])[mask]
+        move_mask = np.repeat(mask, offsets[1:] - offsets[:-1])
+        merged["moves"][move_start:move_start + int(lengths.sum())] = moves[move_mask]
+        merged["move_offsets"][puzzle_start + 1:end + 1] = move_start + np.cumsum(lengths)
+        puzzle_start = end
+        move_start += int(lengths.sum())
+    for array in merged.values():
+        array.flush()
+    del merged
+
+    with open(os.path.join(tmp_folder, "info.json"), "w") as f:
+        json.dump({
+            "num_puzzles": num_puzzles,
+            "num_moves": num_moves,
+            "graph_size": graph_size,
+            "num_tiles": num_tiles,
+            "directions": list(DIRECTIONS),
+            "move_encoding": "tile * 4 + direction",
+            "grid_layout": "[y, x], -1 for empty cells"
+        }, f, indent=2)
+    shutil.rmtree(tensors_folder, ignore_errors=True)
+    os.replace(tmp_folder, tensors_folder)
+    return tensors_folder
+
+
+def load_tensors(output_folder: str, mmap_mode: str = "r") -> dict:
+    """Map the merged arrays of `output_folder`; `info` holds the store description."""
+    tensors_folder = os.path.join(output_folder, TENSORS_FOLDER)
+    tensors = {
+        name: np.load(os.path.join(tensors_folder, f"{name}.npy"), mmap_mode=mmap_mode)
+        for name in ARRAY_NAMES
+    }
+    with open(os.path.join(tensors_folder, "info.json")) as f:
+        tensors["info"] = json.load(f)
+    return tensors
+
+
+def decode_moves(codes: np.ndarray) -> list:
+    """Turn encoded moves back into (block tag, direction) pairs."""
+    return [(block_name(code // 4), DIRECTIONS[code % 4]) for code in np.asarray(codes).tolist()]
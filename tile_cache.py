@@ -0,0 +1,80 @@
+"""Decode-once cache of the tile crops of source images.
+
+`ImageGraph` pads the source image and splits it into N x N tiles; every puzzle cut from the
+same image with the same tiling needs exactly the same tiles. `TileCache` keeps them per
+source path, tiling and tile size, so the image is decoded and padded once, with an LRU
+bound on the number of images and bytes held. Only the tiles are kept: the decoded and
+padded images are not needed once they are split.
+"""
+import typing
+from collections import OrderedDict
+
+from PIL import Image
+
+
+class TileSet:
+    """The tile crops of one source file in graph chunk order."""
+
+    def __init__(
+            self,
+            chunk_size: typing.Tuple[int, int],
+            tiles: typing.List[Image.Image],
+            tile_array=None
+            ) -> None:
+        self.chunk_size = chunk_size
+        self.tiles = tiles
+        # (tiles, height, width, 3) RGB pixels of the tiles, when they come from a `TileStore`.
+        self.tile_array = tile_array
+
+    @property
+    def nbytes(self) -> int:
+        return sum(image.width * image.height * len(image.getbands()) for image in self.tiles or ())
+
+
+class TileCache:
+    """LRU cache of `TileSet`s, keyed by `(path, tiles_per_side, max_tile_size)` in `ImageGraph`.
+
+    Entries are evicted oldest first once more than `max_entries` images or, when set,
+    more than `max_bytes` of pixel data are held. The most recently added entry is always
+    kept, even if it alone exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_entries: int = 16, max_bytes: int = None) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: typing.Hashable, loader: typing.Callable[[typing.Hashable], TileSet]) -> TileSet:
+        """Return the tiles for `key`, calling `loader(key)` on a miss."""
+        tile_set = self._entries.get(key)
+        if tile_set is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return tile_set
+
+        self.misses += 1
+        tile_set = loader(key)
+        self._entries[key] = tile_set
+        self._nbytes += tile_set.nbytes
+        self._evict()
+        return tile_set
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._nbytes = 0
+
+    def _evict(self) -> None:
+        while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None and self._nbytes > self.max_bytes)):
+            _, tile_set = self._entries.popitem(last=False)
+            self._nbytes -= tile_set.nbytes
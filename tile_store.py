@@ -0,0 +1,235 @@
+"""Pre-split source tiles in one memory-mapped file, shared by every worker process.
+
+`ImageGraph` decodes, pads and splits its source image, and every worker process of a run
+does so for every image it handles. `build_tile_store` does this once: the tiles of all
+images are appended to a data file `<store>/tiles.<generation>.bin` as raw RGB arrays of
+shape (tiles, height, width, 3), in chunk order, and `<store>/index.json` names the data file
+and records the byte offset and tile size of every image. `TileStore` maps the file read-only, so all workers read the same page-cache-backed
+bytes and no JPEG is decoded during generation.
+
+Entries are keyed by file name and remember the size and modification time of their source,
+so a changed image is decoded again instead of served stale. A store is built for one
+`max_tile_size` and `tiles_per_side`; `ImageGraph`s asking for others decode as usual. Building again
+appends only the images that are missing or changed. The tiles a changed image replaced
+stay in the file as dead bytes until they outweigh the live ones; the next build then
+compacts the store into a new data file.
+
+Example:
+    python tile_store.py --images images --output tile_store --max-tile-size 256
+    python generate_dataset.py --images images --tile-store tile_store --max-tile-size 256
+"""
+import argparse
+import json
+import os
+import typing
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+from graph_embedding import ImageGraph
+from tile_cache import TileSet
+
+DATA_FILE = "tiles.bin"
+INDEX_FILE = "index.json"
+
+
+def _source_stat(image_path: str) -> dict:
+    stat = os.stat(image_path)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def _decode_tiles(task: typing.Tuple[str, int, int]) -> typing.Tuple[str, np.ndarray]:
+    """Pool task: the RGB tiles of one image as a (tiles, height, width, 3) array."""
+    image_path, max_tile_size, tiles_per_side = task
+    image_graph = ImageGraph(
+        image_path,
+        graph_size=tiles_per_side,
+        max_tile_size=max_tile_size,
+        tiles_per_side=tiles_per_side
+        )
+    return image_path, np.stack([np.asarray(tile.convert("RGB")) for tile in image_graph.tiles])
+
+
+def _read_index(store_folder: str) -> dict:
+    index_path = os.path.join(store_folder, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def _entry_nbytes(entry: dict, tiles_per_side: int) -> int:
+    return tiles_per_side * tiles_per_side * entry["tile_height"] * entry["tile_width"] * 3
+
+
+def build_tile_store(
+        image_paths: typing.List[str],
+        store_folder: str,
+        max_tile_size: int = None,
+        workers: int = None,
+        tiles_per_side: int = 3
+        ) -> int:
+    """Add the tiles of `image_paths` missing from the store; returns the number added.
+
+    Images are decoded on a process pool and written in one sequential stream. New images
+    are appended to the data file, past every byte the current index points at. When the
+    settings changed, or when the tiles of changed images left more dead bytes in the file
+    than live ones, a new data file is written instead, holding the live tiles followed by
+    the new ones. Either way the index is replaced atomically once the data is on disk, so
+    an interrupted build and readers running meanwhile see the previous store intact.
+    """
+    os.makedirs(store_folder, exist_ok=True)
+    index = _read_index(store_folder)
+    settings_changed = (
+        index is None
+        or index["max_tile_size"] != max_tile_size
+        or index.get("tiles_per_side", 3) != tiles_per_side
+    )
+    old_images = {} if settings_changed else index["images"]
+    old_data_file = None if index is None else index.get("data_file", DATA_FILE)
+    missing = []
+    for image_path in image_paths:
+        entry = old_images.get(os.path.basename(image_path))
+        if entry is None or any(entry[key] != value for key, value in _source_stat(image_path).items()):
+            missing.append(image_path)
+    # Entries of changed images are superseded by the new tiles.
+    missing_names = {os.path.basename(image_path) for image_path in missing}
+    images = {name: entry for name, entry in old_images.items() if name not in missing_names}
+    rewrite = settings_changed
+    if not rewrite:
+        live_bytes = sum(_entry_nbytes(entry, tiles_per_side) for entry in images.values())
+        # Everything but the live tiles is dead, the entries superseded now included.
+        dead_bytes = os.path.getsize(os.path.join(store_folder, old_data_file)) - live_bytes
+        rewrite = dead_bytes > live_bytes
+    if rewrite:
+        generation = 0 if index is None else index.get("generation", 0) + 1
+        data_file = f"tiles.{generation}.bin"
+    else:
+        generation = index.get("generation", 0)
+        data_file = old_data_file
+
+    # Imported here so that workers, which import this module for `TileStore`, skip it.
+    from tqdm import tqdm
+    data_path = os.path.join(store_folder, data_file)
+    with open(data_path, "wb" if rewrite else "ab") as data, Pool(processes=workers) as pool:
+        offset = data.seek(0, os.SEEK_END)
+        if rewrite and images:
+            # Carry the live tiles over, so the new file holds no dead bytes.
+            old_data = np.memmap(os.path.join(store_folder, old_data_file), dtype=np.uint8, mode="r")
+            for name, entry in sorted(images.items(), key=lambda item: item[1]["offset"]):
+                size = _entry_nbytes(entry, tiles_per_side)
+                data.write(old_data[entry["offset"]:entry["offset"] + size].tobytes())
+                images[name] = {**entry, "offset": offset}
+                offset += size
+            del old_data
+        tasks = [(image_path, max_tile_size, tiles_per_side) for image_path in missing]
+        for image_path, tiles in tqdm(pool.imap(_decode_tiles, tasks, chunksize=4), total=len(tasks), unit="image"):
+            data.write(tiles.tobytes())
+            _, tile_height, tile_width, _ = tiles.shape
+            images[os.path.basename(image_path)] = {
+                "offset": offset,
+                "tile_width": tile_width,
+                "tile_height": tile_height,
+                **_source_stat(image_path)
+            }
+            offset += tiles.nbytes
+        data.flush()
+        os.fsync(data.fileno())
+    new_index = {
+        "max_tile_size": max_tile_size,
+        "tiles_per_side": tiles_per_side,
+        "generation": generation,
+        "data_file": data_file,
+        "images": images
+    }
+    tmp_path = os.path.join(store_folder, f"{INDEX_FILE}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(new_index, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(store_folder, INDEX_FILE))
+    if rewrite and old_data_file is not None and old_data_file != data_file:
+        # Readers that mapped the old file keep their mapping after it is unlinked.
+        old_data_path = os.path.join(store_folder, old_data_file)
+        if os.path.exists(old_data_path):
+            os.remove(old_data_path)
+    return len(missing)
+
+
+class TileStore:
+    """Read-only view of a tile store, safe to open in every worker process."""
+
+    def __init__(self, store_folder: str) -> None:
+        index = _read_index(store_folder)
+        if index is None:
+            raise FileNotFoundError(f"No tile store index in {store_folder}")
+        self.store_folder = store_folder
+        self.max_tile_size = index["max_tile_size"]
+        # Stores written before tilings were configurable hold 3x3 tiles.
+        self.tiles_per_side = index.get("tiles_per_side", 3)
+        self.images = index["images"]
+        # Stores written before data files were versioned use `tiles.bin`.
+        data_path = os.path.join(store_folder, index.get("data_file", DATA_FILE))
+        self.data = np.memmap(data_path, dtype=np.uint8, mode="r") if os.path.getsize(data_path) else None
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def tile_array(
+            self,
+            image_path: str,
+            max_tile_size: int = None,
+            tiles_per_side: int = 3
+            ) -> typing.Optional[np.ndarray]:
+        """The (tiles, height, width, 3) tiles of `image_path` as a view into the mapped file.
+
+        None when the image is not in the store, changed since it was stored or was stored
+        for another `max_tile_size` or `tiles_per_side`.
+        """
+        entry = self.images.get(os.path.basename(image_path))
+        if entry is None or max_tile_size != self.max_tile_size or tiles_per_side != self.tiles_per_side:
+            return None
+        if any(entry[key] != value for key, value in _source_stat(image_path).items()):
+            return None
+        shape = (tiles_per_side * tiles_per_side, entry["tile_height"], entry["tile_width"], 3)
+        size = int(np.prod(shape))
+        return self.data[entry["offset"]:entry["offset"] + size].reshape(shape)
+
+    def get(self, image_path: str, max_tile_size: int = None, tiles_per_side: int = 3) -> typing.Optional[TileSet]:
+        """A `TileSet` of `image_path` built from the store, or None like `tile_array`."""
+        tile_array = self.tile_array(image_path, max_tile_size, tiles_per_side)
+        if tile_array is None:
+            return None
+        tiles = [Image.fromarray(tile, "RGB") for tile in tile_array]
+        chunk_size = (tile_array.shape[2], tile_array.shape[1])
+        return TileSet(chunk_size, tiles, tile_array=tile_array)
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Pre-split source images into a shared memory-mapped tile store.")
+    parser.add_argument("--images", default="images", help="Folder with the source images.")
+    parser.add_argument("--output", default="tile_store", help="Folder of the tile store.")
+    parser.add_argument(
+        "--max-tile-size", type=int, default=None,
+        help="Longest tile side in pixels; must match --max-tile-size of generate_dataset.py."
+        )
+    parser.add_argument(
+        "--tiles-per-side", type=int, default=3,
+        help="Tiling of the images; must match --tiles-per-side of generate_dataset.py."
+        )
+    parser.add_argument("--workers", type=int, default=None, help="Defaults to the number of CPUs.")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> None:
+    # Imported here because generate_dataset imports this module.
+    from generate_dataset import list_source_images
+    args = parse_args(argv)
+    image_paths = list_source_images(args.images)
+    added = build_tile_store(image_paths, args.output, args.max_tile_size, args.workers, args.tiles_per_side)
+    print(f"Added {added} of {len(image_paths)} images to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()